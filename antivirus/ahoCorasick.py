@@ -0,0 +1,92 @@
+from collections import deque
+
+
+class Automaton():
+    directLimit = 256
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        self._patterns = {}
+        self._direct = False
+        self._maxLen = 0
+
+    def add(self, pattern, value):
+        state = 0
+        for symbol in pattern:
+            nextState = self._goto[state].get(symbol)
+            if nextState is None:
+                nextState = len(self._goto)
+                self._goto[state][symbol] = nextState
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nextState
+        self._out[state].append(value)
+        self._patterns.setdefault(bytes(pattern), []).append(value)
+        self._maxLen = max(self._maxLen, len(pattern))
+
+    def build(self):
+        self._direct = len(self._patterns) <= self.directLimit
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for symbol, nextState in self._goto[state].items():
+                queue.append(nextState)
+                fail = self._fail[state]
+                while fail and symbol not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(symbol, 0)
+                self._fail[nextState] = fail
+                if self._out[fail]:
+                    self._out[nextState] = self._out[nextState] + \
+                        self._out[fail]
+
+    def search(self, data, cursor):
+        if self._direct:
+            return self.searchDirect(data, cursor)
+        return self.searchAutomaton(data, cursor, 0)
+
+    def searchRange(self, buffer, start, end, cursor):
+        if self._direct:
+            return iter(self.findAll(buffer, start, end))
+        with memoryview(buffer) as view:
+            data = view[start:end]
+        return self.searchAutomaton(data, cursor, start)
+
+    def findAll(self, text, start, end):
+        hits = []
+        for pattern, values in self._patterns.items():
+            first = max(start - len(pattern) + 1, 0)
+            position = text.find(pattern, first, end)
+            while position != -1:
+                hitEnd = position + len(pattern)
+                hits.extend((hitEnd, value) for value in values)
+                position = text.find(pattern, position + 1, end)
+        hits.sort()
+        return hits
+
+    def searchDirect(self, data, cursor):
+        carry = cursor[0] or b''
+        text = carry + data if carry else data
+        offset = len(carry)
+        hits = self.findAll(text, offset, len(text))
+        keep = min(self._maxLen - 1, len(text))
+        cursor[0] = bytes(text[len(text)-keep:])
+        return ((end - offset, value) for end, value in hits)
+
+    def searchAutomaton(self, data, cursor, offset):
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        state = cursor[0]
+        for index, symbol in enumerate(data, offset + 1):
+            while state and symbol not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(symbol, 0)
+            if out[state]:
+                cursor[0] = state
+                for value in out[state]:
+                    yield index, value
+        cursor[0] = state
@@ -1,6 +1,9 @@
 import fileManager
+import daemon
 import interface
+import watcher
 import sys
+import time
 import argparse
 from pathlib import Path
 from curses import wrapper
@@ -20,6 +23,16 @@ class ScanThread(threading.Thread):
         self.scanner.simpleScan(self.toScan, self.fast)
 
 
+class ChangeScanThread(threading.Thread):
+    def __init__(self, scanner, changed):
+        threading.Thread.__init__(self)
+        self.scanner = scanner
+        self.changed = changed
+
+    def run(self):
+        self.scanner.scanChanged(self.changed)
+
+
 def main(arguments):
     if len(arguments) == 0:
         wrapper(interactiveMain)
@@ -28,10 +41,10 @@ def main(arguments):
 
 
 def cmdMain(arguments):
-    scanner = fileManager.Scanner(bodyPath, hashPath, None)
     parser = argparse.ArgumentParser()
     parser.add_argument(
         'path',
+        nargs='?',
         help='path to the file or directory to be scanned'
     )
     parser.add_argument(
@@ -39,6 +52,150 @@ def cmdMain(arguments):
         action='store_true',
         help='scan all files, not just new, unscanned or changed files'
     )
+    parser.add_argument(
+        '-paranoid',
+        type=float,
+        default=0,
+        metavar='PERCENT',
+        help='in fast mode, re-hash this percentage of unchanged files'
+    )
+    parser.add_argument(
+        '-chunk',
+        type=int,
+        default=1024,
+        metavar='KB',
+        help='size of the blocks in which files are read'
+    )
+    parser.add_argument(
+        '-jobs',
+        type=int,
+        default=1,
+        metavar='N',
+        help='number of processes scanning files in parallel'
+    )
+    parser.add_argument(
+        '-readers',
+        type=int,
+        default=0,
+        metavar='N',
+        help='read files in N background threads while matching'
+    )
+    parser.add_argument(
+        '-index',
+        default='index.db',
+        metavar='PATH',
+        help='file index to use, a .json path selects the JSON backend'
+    )
+    parser.add_argument(
+        '-verdicts',
+        type=int,
+        default=100000,
+        metavar='N',
+        help='remember the verdicts for up to N file contents, 0 disables'
+    )
+    parser.add_argument(
+        '-archiveDepth',
+        type=int,
+        default=3,
+        metavar='N',
+        help='scan inside archives nested up to N levels deep, 0 disables'
+    )
+    parser.add_argument(
+        '-archiveMembers',
+        type=int,
+        default=10000,
+        metavar='N',
+        help='scan at most N members of each archive'
+    )
+    parser.add_argument(
+        '-archiveRatio',
+        type=int,
+        default=100,
+        metavar='N',
+        help='stop decompressing members that grow over N times their size'
+    )
+    parser.add_argument(
+        '-archiveJobs',
+        type=int,
+        default=4,
+        metavar='N',
+        help='number of threads scanning the members of a zip archive'
+    )
+    parser.add_argument(
+        '-matchBudget',
+        type=float,
+        default=120.0,
+        metavar='SECONDS',
+        help='flag files whose body matching takes longer, 0 disables'
+    )
+    parser.add_argument(
+        '-readLimit',
+        type=float,
+        default=0,
+        metavar='MB',
+        help='read at most MB megabytes per second, 0 is unlimited'
+    )
+    parser.add_argument(
+        '-nice',
+        type=int,
+        metavar='N',
+        help='scan with CPU niceness N (0-19)'
+    )
+    parser.add_argument(
+        '-ionice',
+        choices=['realtime', 'best-effort', 'idle'],
+        help='scan in the given I/O scheduling class'
+    )
+    parser.add_argument(
+        '-dropCache',
+        action='store_true',
+        help='read files sequentially and drop them from the page cache'
+    )
+    parser.add_argument(
+        '-resume',
+        action='store_true',
+        help='continue an interrupted scan of the same path'
+    )
+    parser.add_argument(
+        '-checkpoint',
+        type=float,
+        default=30.0,
+        metavar='SECONDS',
+        help='save the progress of the scan this often, 0 disables'
+    )
+    parser.add_argument(
+        '-rolling',
+        type=float,
+        metavar='SECONDS',
+        help='keep rescanning the path one slice at a time, covering it '
+             'once every SECONDS'
+    )
+    parser.add_argument(
+        '-shards',
+        type=int,
+        metavar='N',
+        help='number of slices used by -rolling, one per minute by default'
+    )
+    parser.add_argument(
+        '-watch',
+        action='store_true',
+        help='after the scan, keep watching the path and scan changed files'
+    )
+    parser.add_argument(
+        '-stats',
+        action='store_true',
+        help='print per-stage timings and counters after the scan'
+    )
+    parser.add_argument(
+        '-serve',
+        metavar='SOCKET',
+        help='run as a daemon answering scan requests on a unix socket'
+    )
+    parser.add_argument(
+        '-client',
+        metavar='SOCKET',
+        help='send the scan request to a daemon listening on SOCKET'
+    )
     parser.add_argument(
         '-cut',
         action='store_true',
@@ -49,12 +206,72 @@ def cmdMain(arguments):
         action='store_true',
         help='print the files/directories to which access was denied'
     )
+    parser.add_argument(
+        '-skipped',
+        action='store_true',
+        help='print how many files could not match any signature and why'
+    )
     args = parser.parse_args(arguments)
+    if args.serve:
+        daemon.serve(args.serve, makeScanner(args))
+        return
+    if args.path is None:
+        parser.error('the path argument is required')
     path = Path(args.path)
     if not path.exists():
         print('Path invalid')
         return
+    if args.client:
+        clientScan(path, args)
+        return
+    scanner = makeScanner(args)
+    if args.rolling:
+        rollingLoop(scanner, path, args)
+        return
+    if args.watch:
+        watch = watcher.Watcher(path)
     scanner.simpleScan(path, not args.slow)
+    printResult(scanner, args)
+    if args.watch:
+        watchLoop(scanner, path, watch, args)
+
+
+def makeScanner(args):
+    scanner = fileManager.Scanner(bodyPath, hashPath, None, args.index)
+    scanner.paranoid = args.paranoid
+    scanner.chunkSize = max(args.chunk, 1) * 1024
+    scanner.jobs = args.jobs
+    scanner.readers = args.readers
+    scanner.archiveDepth = args.archiveDepth
+    scanner.archiveMembers = args.archiveMembers
+    scanner.archiveRatio = args.archiveRatio
+    scanner.archiveJobs = args.archiveJobs
+    scanner.matchBudget = args.matchBudget
+    scanner.resume = args.resume
+    scanner.governor.readLimit = args.readLimit
+    scanner.governor.nice = args.nice
+    scanner.governor.ioClass = args.ionice
+    scanner.governor.dropCache = args.dropCache
+    scanner.checkpointInterval = args.checkpoint
+    scanner.setVerdictCache(args.verdicts)
+    return scanner
+
+
+def clientScan(path, args):
+    try:
+        report, fixed = daemon.requestScan(
+            args.client, path, not args.slow, args.cut
+        )
+    except OSError:
+        print('Daemon not reachable')
+        return
+    except ValueError as error:
+        print(error)
+        return
+    interface.printCmdResult(report, fixed, args.denied, args.skipped)
+
+
+def printResult(scanner, args):
     report = scanner.getReport()
     if args.cut:
         fixed = []
@@ -63,18 +280,50 @@ def cmdMain(arguments):
                 fixed.append(str(fixable[0]))
     else:
         fixed = None
-    interface.printCmdResult(report, fixed, args.denied)
+    interface.printCmdResult(report, fixed, args.denied, args.skipped)
+    if args.stats:
+        interface.printCmdStats(scanner.stats, scanner.signatureName)
+
+
+def watchLoop(scanner, path, watch, args):
+    try:
+        while True:
+            if watch.takeOverflow():
+                scanner.simpleScan(path, True)
+            elif (changed := watch.ready(1.0)):
+                scanner.scanChanged(changed)
+            else:
+                continue
+            printResult(scanner, args)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watch.close()
+
+
+def rollingLoop(scanner, path, args):
+    shards = args.shards or fileManager.defaultShards(args.rolling)
+    shard = fileManager.rollingSlice(shards, args.rolling)
+    try:
+        while True:
+            due = time.time() + \
+                fileManager.untilNextSlice(shards, args.rolling)
+            scanner.rolling = (shard, shards)
+            scanner.simpleScan(path, True)
+            printResult(scanner, args)
+            shard = (shard + 1) % shards
+            time.sleep(max(due - time.time(), 0))
+    except KeyboardInterrupt:
+        pass
 
 
 def interactiveMain(stdscr):
     ui = interface.Interface(stdscr)
-    scanner = fileManager.Scanner(
-        bodyPath,
-        hashPath,
-        (ui.setProgress, ui.setFilProgress)
-    )
+    scanner = fileManager.Scanner(bodyPath, hashPath, ui.channel)
     while True:
         scanType = ui.getScanType()
+        scanner.resume = scanType == 1
+        scanner.rolling = None
         if scanType == 'back':
             return
         elif scanType == 0:
@@ -90,19 +339,33 @@ def interactiveMain(stdscr):
                 ui.scanWindow(scanTh)
                 ui.displayReport(scanner)
                 continue
-        else:
+        elif scanType in (1, 3):
             path = ui.getPath()
             if path == 'back':
                 continue
             else:
                 lastOk = False
-                time = ui.getTime()
-                if time == 'back':
+                period = ui.getTime()
+                if period == 'back':
                     continue
+                shards = None
+                if scanType == 3:
+                    shards = fileManager.defaultShards(period)
+                    shard = fileManager.rollingSlice(shards, period)
                 while True:
-                    act = ui.periodicScanMenu(path, time, lastOk)
+                    wait = period
+                    rolling = None
+                    if shards is not None:
+                        wait = fileManager.untilNextSlice(shards, period)
+                        rolling = (shard, shards)
+                    act = ui.periodicScanMenu(
+                        path, wait, lastOk, scanner.governor, rolling
+                    )
                     if act == 'back':
                         break
+                    scanner.rolling = rolling
+                    if shards is not None:
+                        shard = (shard + 1) % shards
                     scanTh = ScanThread(scanner, path, True)
                     scanTh.start()
                     ui.scanWindow(scanTh)
@@ -113,6 +376,30 @@ def interactiveMain(stdscr):
                         lastOk = None
                     else:
                         lastOk = True
+        else:
+            path = ui.getPath()
+            if path == 'back':
+                continue
+            watch = watcher.Watcher(path)
+            lastOk = False
+            while True:
+                act = ui.watchMenu(path, watch, lastOk)
+                if act == 'back':
+                    break
+                if act == 'rescan':
+                    scanTh = ScanThread(scanner, path, True)
+                else:
+                    scanTh = ChangeScanThread(scanner, act)
+                scanTh.start()
+                ui.scanWindow(scanTh)
+                report = scanner.getReport()
+                if len(report[0] + report[1]) != 0:
+                    ui.displayReport(scanner)
+                elif scanner.aborted:
+                    lastOk = None
+                else:
+                    lastOk = True
+            watch.close()
 
 
 if __name__ == '__main__':
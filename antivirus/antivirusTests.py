@@ -1,4 +1,35 @@
 import os
+import ahoCorasick
+import sigBase
+import fileManager
+import indexStore
+import daemon
+import benchmark
+import progress
+import threading
+import json
+import gzip
+import io
+import tarfile
+import zipfile
+import struct
+import watcher
+import governor
+import pickle
+import hashlib
+import time
+from pathlib import Path
+sigDir = Path(__file__).parent / 'signatures'
+
+
+def mainSig(line):
+    return (sigDir / 'main.ndb').read_text().split('\n')[line].split(':')[3]
+
+
+def tmpScanner(indexPath, channel=None, bodyPath=sigDir / 'main.ndb'):
+    return fileManager.Scanner(bodyPath, sigDir / 'main.hdb', channel,
+                               indexPath)
+
 
 expectedOut = [
     '/mnt/c/Users/Jeremi/Desktop/anti/testFiles/scanTest/ba.txt -> Win Test EICAR_HDB-1\n',
@@ -19,3 +50,875 @@ def test_cmdScan():
 def test_cmdScanDenied():
     stream = os.popen('python3 antivirus.py testFiles/scanTest -denied')
     assert stream.read() == expectedOut[1]
+
+
+def test_bodySigAnchors():
+    base = sigBase.SigBase(
+        sigDir / 'main.ndb',
+        sigDir / 'main.hdb'
+    )
+    sig = mainSig(1)
+    fileBytes = bytes(10) + bytes.fromhex(sig) + b'\xff' * 10
+    span, name = base.bodySigInFile(fileBytes, None)
+    assert name == 'Win.Trojan.Hotkey-1'
+    assert span == (10, 10 + len(sig) // 2)
+    assert base.bodySigInFile(bytes(100), None) is None
+
+
+def test_anchorSearchModes():
+    text = bytes.fromhex('00aabbccdd00')
+    found = []
+    for directLimit in (0, 256):
+        automaton = ahoCorasick.Automaton()
+        automaton.directLimit = directLimit
+        for index, pattern in enumerate(['aabb', 'bbcc', 'ccdd', 'ff']):
+            automaton.add(bytes.fromhex(pattern), index)
+        automaton.build()
+        cursor = [0]
+        hits = list(automaton.search(text[:3], cursor))
+        for end, value in automaton.search(text[3:], cursor):
+            hits.append((end + 3, value))
+        found.append(hits)
+    assert found[0] == found[1] == [(3, 0), (4, 1), (5, 2)]
+
+
+def test_automatonStreams(tmp_path, monkeypatch):
+    monkeypatch.setattr(ahoCorasick.Automaton, 'directLimit', 0)
+    bodyPath = tmp_path / 'test.ndb'
+    hashPath = tmp_path / 'test.hdb'
+    bodyPath.write_text(
+        'First:0:*:aabbccdd{10}ee\nTail:0:*:11223344\n'
+        'Anch:0:0,4096:deadbeef\nNearEnd:0:EOF-3,2:aabbcc\n'
+        'Split:0:*:5566*7788\nEarly:0:*:aabb{0-1}(cc|ddaabbccee)*ee\n'
+        'Class:0:*:aabb*c?*ddee\nBroken:0:*:(aa|)\n'
+    )
+    hashPath.write_text('')
+    base = sigBase.SigBase(bodyPath, hashPath, False)
+    assert len(base.bodySignatures) == 7
+    cases = [
+        (bytes(20) + bytes.fromhex('aabbccdd11223344'), 'Tail'),
+        (bytes(500) + bytes.fromhex('11223344') + bytes(520), 'Tail'),
+        (bytes(30) + bytes.fromhex('aabbcc'), 'NearEnd'),
+        (bytes.fromhex('005566') + bytes(9) + bytes.fromhex('7788'), 'Split'),
+        (bytes.fromhex('aabbddaabbccee'), 'Early'),
+        (bytes.fromhex('aabb00c500ddee'), 'Class')
+    ]
+    for content, name in cases:
+        stream = base.openStream(len(content))
+        ranged = base.openStream(len(content))
+        for start in range(0, len(content), 5):
+            stream.feed(content[start:start+5])
+            ranged.feedRange(content, start, min(start + 5, len(content)))
+        assert stream.finish()[1] == ranged.finish()[1] == name
+
+
+def test_wideOffsetStream(tmp_path):
+    (tmp_path / 'test.ndb').write_text(
+        'Wide:0:16,100000000:deadbeef\nLate:0:EOF-8,4:c0ffee\n'
+    )
+    (tmp_path / 'test.hdb').write_text('')
+    base = sigBase.SigBase(tmp_path / 'test.ndb', tmp_path / 'test.hdb')
+    assert base.overlap == 4
+    chunk = bytes(1 << 16)
+    for position, name in ((3 << 20, 'Wide'), (8, None)):
+        content = bytearray(4 << 20)
+        content[position:position+4] = bytes.fromhex('deadbeef')
+        stream = base.openStream(len(content))
+        longest = 0
+        for start in range(0, len(content), len(chunk)):
+            stream.feed(content[start:start+len(chunk)])
+            longest = max(longest, len(stream._tail))
+        assert longest < 16
+        found = stream.finish()
+        assert (found and found[1]) == name
+    content = bytes(20) + bytes.fromhex('c0ffee') + bytes(3)
+    assert base.bodySigInFile(content, None)[1] == 'Late'
+    assert base.bodySigInFile(content + bytes(5), None) is None
+
+
+def test_bodySigWildcards():
+    sig = sigBase.BodySignature(
+        'Test', '0', '*', 'aabb??cc*dd{1-2}e?(01|0203)'
+    )
+    assert [part.anchors for part in sig.parts] == [(b'\xaa\xbb',), (b'\xdd',)]
+    match = sig.match(b'\x00\xaa\xbb\x00\xcc\x01\xdd\x00\xe5\x02\x03')
+    assert match == (1, 11)
+    assert sig.match(b'\x00\xaa\xbb\xcc\x01\xdd\x00\xe5\x01') is None
+    sig = sigBase.BodySignature(
+        'Test', '0', '*', 'aabb{0-1}(cc|ddaabbccee)*ee'
+    )
+    assert sig.match(bytes.fromhex('aabbddaabbccee')) == (3, 7)
+    sig = sigBase.BodySignature('Test', '0', '*', 'aabb*(cc|dd)*eeff')
+    assert sig.match(bytes.fromhex('aabb00dd00eeff')) == (0, 7)
+    assert sig.match(bytes.fromhex('aabb00ee00eeff')) is None
+
+
+def test_fastScanSkipsUnchanged(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    toScan = tmp_path / 'scan'
+    toScan.mkdir()
+    infected = toScan / 'infected'
+    infected.write_bytes(bytes.fromhex(mainSig(0)))
+    scanner = fileManager.Scanner(
+        sigDir / 'main.ndb',
+        sigDir / 'main.hdb',
+        None
+    )
+    scanner.simpleScan(toScan, True)
+    assert len(scanner.getReport()[0]) == 1
+
+    def noRead(*args):
+        raise AssertionError('unchanged file was read')
+    monkeypatch.setattr(fileManager, 'readFile', noRead)
+    monkeypatch.setattr(fileManager, 'cachedRead', noRead)
+    scanner = scanner.session()
+    scanner.simpleScan(toScan, True)
+    assert scanner.getReport()[0][0][1] == 'Legacy Trojan Agent-1'
+    assert 'filesRead' not in scanner.stats.counters
+
+
+def test_rescanUsesNewVerdict(tmp_path):
+    bodyPath = tmp_path / 'test.ndb'
+    hashPath = tmp_path / 'test.hdb'
+    bodyPath.write_text('Old:0:*:aabbccdd\n')
+    hashPath.write_text('')
+    scanDir = tmp_path / 'scan'
+    scanDir.mkdir()
+    sample = scanDir / 'sample'
+    sample.write_bytes(b'x' * 10 + bytes.fromhex('11223344'))
+    scanner = fileManager.Scanner(bodyPath, hashPath, None, tmp_path / 'i.db')
+    scanner.simpleScan(scanDir, True)
+    assert scanner.getReport()[0] == []
+    scanner.close()
+    bodyPath.write_text('New:0:*:11223344\n')
+    os.utime(bodyPath, ns=(0, 0))
+    os.utime(sample, ns=(0, 0))
+    scanner = fileManager.Scanner(bodyPath, hashPath, None, tmp_path / 'i.db')
+    scanner.simpleScan(scanDir, True)
+    assert [info[1] for info in scanner.getReport()[0]] == ['New']
+    scanner.close()
+
+
+def test_streamAcrossChunks():
+    base = sigBase.SigBase(sigDir / 'main.ndb', sigDir / 'main.hdb')
+    sig = mainSig(4)
+    fileBytes = bytes(7) + bytes.fromhex(sig) + bytes(5)
+    for chunkSize in (1, 3, 64):
+        stream = base.openStream(len(fileBytes))
+        for start in range(0, len(fileBytes), chunkSize):
+            stream.feed(fileBytes[start:start+chunkSize])
+        span, name = stream.finish()
+        assert name == 'Win.Worm.Gaobot-1'
+        assert span == (7, len(fileBytes) - 5)
+
+
+def test_parallelScan(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    toScan = tmp_path / 'scan'
+    toScan.mkdir()
+    sigs = (sigDir / 'main.ndb').read_text().split('\n')
+    for index in range(12):
+        content = bytes(100 + index)
+        if index % 3 == 0:
+            content += bytes.fromhex(sigs[index].split(':')[3])
+        (toScan / f'file{index}').write_bytes(content)
+    reports = []
+    for jobs, readers in ((1, 0), (3, 0), (1, 2)):
+        scanner = fileManager.Scanner(
+            sigDir / 'main.ndb',
+            sigDir / 'main.hdb',
+            None
+        )
+        scanner.jobs = jobs
+        scanner.readers = readers
+        scanner.simpleScan(toScan, False)
+        reports.append(sorted(scanner.getReport()[0]))
+    assert len(reports[0]) == 4
+    assert reports[0] == reports[1] == reports[2]
+
+
+def test_hashIndex():
+    base = sigBase.SigBase(sigDir / 'main.ndb', sigDir / 'main.hdb')
+    eicar = '44d88612fea8a8f36de82e1278abb02f'
+    assert base.fileHashMatch({'md5': eicar}, 68) == 'Win.Test.EICAR_HDB-1'
+    assert base.fileHashMatch({'md5': eicar}, 69) is None
+    assert base.needsHash(68)
+    assert not base.needsHash(69)
+
+
+def test_shaHashDatabase(tmp_path):
+    bodyPath = tmp_path / 'test.ndb'
+    hashPath = tmp_path / 'test.hdb'
+    bodyPath.write_text('Body:0:*:aabbccdd\n')
+    hashPath.write_text('')
+    data = b'sha payload' * 10
+    sha1 = hashlib.sha1(data).hexdigest()
+    sha256 = hashlib.sha256(data).hexdigest()
+    (tmp_path / 'test.hsb').write_text(
+        f'{sha1}:{len(data)}:Test.Sha1-1\n{"0" * 64}:*:Test.Other-1\n'
+    )
+    base = sigBase.SigBase(bodyPath, hashPath)
+    assert base.digestsFor(len(data)) == ('sha1', 'sha256')
+    assert base.digestsFor(5) == ('sha256',)
+    fileHash = sigBase.MultiHash(base.digestsFor(len(data)))
+    fileHash.update(data)
+    digests = fileHash.hexdigests()
+    assert digests == {'sha1': sha1, 'sha256': sha256}
+    assert base.fileHashMatch(digests, len(data)) == 'Test.Sha1-1'
+    assert base.fileHashMatch(digests, len(data) + 1) is None
+    scanDir = tmp_path / 'scan'
+    scanDir.mkdir()
+    (scanDir / 'sample').write_bytes(data[::-1])
+    for readers in [0, 2]:
+        for path in tmp_path.glob('i.db*'):
+            path.unlink()
+        (tmp_path / 'test.hsb').write_text(f'{"0" * 64}:*:Test.Other-1\n')
+        scanner = fileManager.Scanner(
+            bodyPath, hashPath, None, tmp_path / 'i.db'
+        )
+        scanner.readers = readers
+        scanner.simpleScan(scanDir, False)
+        entry = scanner.fileIndex.get(str(scanDir / 'sample'))
+        assert sorted(entry['digests']) == ['sha256']
+        assert scanner.stats.counters['filesRead'] == 1
+        scanner.close()
+        reversedHash = hashlib.sha256(data[::-1]).hexdigest()
+        (tmp_path / 'test.hsb').write_text(f'{reversedHash}:*:Test.New-1\n')
+        scanner = fileManager.Scanner(
+            bodyPath, hashPath, None, tmp_path / 'i.db'
+        )
+        scanner.readers = readers
+        scanner.simpleScan(scanDir, True)
+        assert scanner.getReport()[1] == [(scanDir / 'sample', 'Test New-1')]
+        assert scanner.stats.counters['digestHits'] == 1
+        assert 'filesRead' not in scanner.stats.counters
+        scanner.close()
+
+
+def test_sigCacheInvalidation(tmp_path):
+    bodyPath = tmp_path / 'test.ndb'
+    hashPath = tmp_path / 'test.hdb'
+    bodyPath.write_text('First:0:*:aabbccdd\n')
+    hashPath.write_text('')
+    base = sigBase.SigBase(bodyPath, hashPath)
+    assert (tmp_path / 'test.cache').exists()
+    cached = sigBase.SigBase(bodyPath, hashPath)
+    assert cached.bodySigInFile(b'\xaa\xbb\xcc\xdd', None)[1] == 'First'
+    bodyPath.write_text('Second:0:*:11223344\n')
+    os.utime(bodyPath, ns=(0, 0))
+    base = sigBase.SigBase(bodyPath, hashPath)
+    assert base.bodySigInFile(b'\x11\x22\x33\x44', None)[1] == 'Second'
+
+
+def test_indexMigration(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    entry = {'stat': [1, 2, 3, 4], 'result': [False, None]}
+    (tmp_path / 'index.json').write_text(json.dumps({
+        '/some/file': entry,
+        '/legacy/file': [False, 'abc']
+    }))
+    index = indexStore.openIndex(tmp_path / 'index.db')
+    assert index.get('/some/file') == entry
+    assert index.get('/legacy/file') == {
+        'stat': None, 'result': [False, 'abc'], 'digests': {'md5': 'abc'}
+    }
+    assert not (tmp_path / 'index.json').exists()
+    index.set('/some/other', entry)
+    index.set('/somewhere', entry)
+    index.close()
+    index = indexStore.openIndex(tmp_path / 'index.db')
+    assert sorted(index.paths('/some/')) == ['/some/file', '/some/other']
+    index.close()
+    (tmp_path / 'clean').write_bytes(b'clean' * 20)
+    (tmp_path / 'index.json').write_text(json.dumps({
+        str(tmp_path / 'clean'): [True, 'abc', 'Old Name']
+    }))
+    (tmp_path / 'index.db').unlink()
+    scanner = fileManager.Scanner(sigDir / 'main.ndb', sigDir / 'main.hdb',
+                                  None)
+    scanner.simpleScan(tmp_path / 'clean', True)
+    assert scanner.getReport()[1] == []
+    assert scanner.stats.counters['filesRead'] == 1
+    scanner.close()
+
+
+def test_findFilesSymlinkLoop(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    toScan = tmp_path / 'scan'
+    (toScan / 'sub').mkdir(parents=True)
+    (toScan / 'a').write_bytes(b'a')
+    (toScan / 'sub' / 'b').write_bytes(b'b')
+    (toScan / 'sub' / 'loop').symlink_to(toScan)
+    scanner = fileManager.Scanner(
+        sigDir / 'main.ndb',
+        sigDir / 'main.hdb',
+        None
+    )
+    found = sorted(path.name for path in scanner.findFiles(toScan))
+    assert found == ['a', 'b']
+
+
+def test_offsetsAndTypes(tmp_path):
+    (tmp_path / 'test.ndb').write_text(
+        'PeOnly:1:*:c0ffee11\n'
+        'AtEntry:6:EP+0:deadbeef\n'
+        'NearEnd:0:EOF-6,2:aabbcc\n'
+    )
+    (tmp_path / 'test.hdb').write_text('')
+    base = sigBase.SigBase(tmp_path / 'test.ndb', tmp_path / 'test.hdb')
+    header = bytearray(0x120)
+    header[:6] = b'\x7fELF\x02\x01'
+    struct.pack_into('<QQ', header, 24, 0x400100, 64)
+    struct.pack_into('<HH', header, 54, 56, 1)
+    struct.pack_into('<I4xQQ8xQ', header, 64, 1, 0, 0x400000, 0x1000)
+    elf = bytes(header)
+    elf = elf[:0x100] + b'\xde\xad\xbe\xef' + elf[0x104:]
+    assert base.bodySigInFile(elf, None) == ((0x100, 0x104), 'AtEntry')
+    header = bytearray(0x80)
+    header[:6] = b'\x7fELF\x01\x01'
+    struct.pack_into('<II', header, 24, 0x8048100, 52)
+    struct.pack_into('<HH', header, 42, 32, 1)
+    struct.pack_into('<IIIIII', header, 52, 1, 0, 0x8048000, 0, 0x1000, 0)
+    assert sigBase.entryPoint(bytes(header)) == 0x100
+    for magic, optSize in ((0x10b, 0xe0), (0x20b, 0xf0)):
+        header = bytearray(0x400)
+        header[:2] = b'MZ'
+        struct.pack_into('<I', header, 0x3c, 0x80)
+        header[0x80:0x84] = b'PE\x00\x00'
+        struct.pack_into('<HHIIIHH', header, 0x84, 0x14c, 2, 0, 0, 0,
+                         optSize, 0x102)
+        struct.pack_into('<HxxIIII', header, 0x98, magic, 0, 0, 0, 0x1f87)
+        for index, section in enumerate(((0x1000, 0x1000, 0x1200, 0x400),
+                                         (0x3000, 0x200, 0x200, 0x1600))):
+            struct.pack_into('<4I', header, 0x98 + optSize + index*40 + 8,
+                             section[1], section[0], section[2], section[3])
+        assert sigBase.entryPoint(bytes(header)) == 0x1387
+    assert base.bodySigInFile(b'\xde\xad\xbe\xef', None) is None
+    assert base.bodySigInFile(b'\xc0\xff\xee\x11', None) is None
+    assert base.bodySigInFile(b'MZ\xc0\xff\xee\x11', None)[1] == 'PeOnly'
+    assert base.bodySigInFile(bytes(10) + b'\xaa\xbb\xcc\x00\x00', None) \
+        == ((10, 13), 'NearEnd')
+    assert base.bodySigInFile(b'\xaa\xbb\xcc' + bytes(10), None) is None
+
+
+def test_mappedAndBufferedReads(tmp_path, monkeypatch):
+    path = tmp_path / 'file'
+    mapFile = fileManager.mapFile
+
+    def readBoth(base, content, chunkSize):
+        path.write_bytes(content)
+        results = []
+        for mapper in (mapFile, lambda *args: None):
+            monkeypatch.setattr(fileManager, 'mapFile', mapper)
+            results.append(fileManager.readFile(
+                base, path, len(content), chunkSize, ('md5',), None
+            ))
+        assert results[0][:2] == results[1][:2]
+        return results[0]
+    base = sigBase.SigBase(sigDir / 'main.ndb', sigDir / 'main.hdb')
+    sig = mainSig(3)
+    content = bytes(5000) + bytes.fromhex(sig) + bytes(3000)
+    assert readBoth(base, content, 1000)[1] == \
+        ((5000, 5000 + len(sig) // 2), 'Doc.Trojan.Layla-1')
+    bodyPath = tmp_path / 'test.ndb'
+    hashPath = tmp_path / 'test.hdb'
+    bodyPath.write_text(
+        'First:0:*:aabbccdd{10}ee\nTail:0:*:11223344\n'
+        'Anch:0:0,4096:deadbeef\nNearEnd:0:EOF-3,2:aabbcc\n'
+    )
+    hashPath.write_text('')
+    base = sigBase.SigBase(bodyPath, hashPath)
+    cases = [
+        (bytes(20) + bytes.fromhex('aabbccdd11223344'), 'Tail'),
+        (bytes(500) + bytes.fromhex('11223344') + bytes(520), 'Tail'),
+        (bytes(30) + bytes.fromhex('aabbcc'), 'NearEnd')
+    ]
+    for content, name in cases:
+        assert readBoth(base, content, 8)[1][1] == name
+
+
+def test_watcherDebounce(tmp_path):
+    watch = watcher.Watcher(tmp_path, debounce=0.2)
+    (tmp_path / 'sub').mkdir()
+    assert watch.ready(0.1) == []
+    (tmp_path / 'sub' / 'new').write_bytes(b'data')
+    (tmp_path / 'top').write_bytes(b'data')
+    assert watch.ready(0.1) == []
+    changed = []
+    for attempt in range(10):
+        changed += watch.ready(0.1)
+    watch.close()
+    assert sorted(changed) == [
+        str(tmp_path / 'sub' / 'new'), str(tmp_path / 'top')
+    ]
+
+
+def test_daemonServesClients(tmp_path):
+    sig = mainSig(3)
+    (tmp_path / 'scan').mkdir()
+    (tmp_path / 'scan' / 'bad').write_bytes(bytes.fromhex(sig))
+    (tmp_path / 'scan' / 'ok').write_bytes(b'clean')
+    scanner = tmpScanner(tmp_path / 'i.db')
+    socketPath = tmp_path / 'av.sock'
+    with daemon.ScanServer(socketPath, scanner) as server:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        replies = []
+        clients = [
+            threading.Thread(target=lambda path=path: replies.append(
+                daemon.requestScan(socketPath, path, True, False)
+            ))
+            for path in [tmp_path / 'scan', tmp_path / 'scan' / 'ok'] * 2
+        ]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        server.shutdown()
+        thread.join()
+    assert sorted(len(report[0]) for report, fixed in replies) == \
+        [0, 0, 1, 1]
+    assert not socketPath.exists()
+
+
+def test_benchmarkStages(tmp_path):
+    config = {
+        'seed': 1, 'bodySigs': 20, 'hashSigs': 20, 'smallFiles': 5,
+        'smallSize': 100, 'hugeFiles': 1, 'hugeSize': 1, 'depth': 2,
+        'width': 2, 'perDir': 1, 'indexEntries': 10, 'chunk': 64,
+        'only': []
+    }
+    results = benchmark.runBenchmarks(config, tmp_path)
+    assert set(results) == {
+        'sigLoad', 'match', 'hash', 'findFiles', 'scan', 'indexSave',
+        'indexLoad'
+    }
+    assert results['findFiles']['files'] == 7
+    assert results['scan']['bytes'] == 500 + (1 << 20)
+
+
+def test_scanStats(tmp_path):
+    sig = mainSig(3)
+    (tmp_path / 'scan').mkdir()
+    (tmp_path / 'scan' / 'bad').write_bytes(bytes.fromhex(sig))
+    (tmp_path / 'scan' / 'ok').write_bytes(b'clean' * 20)
+    scanner = tmpScanner(tmp_path / 'i.db')
+    scanner.simpleScan(tmp_path / 'scan', True)
+    stats = scanner.stats
+    assert stats.counters['filesRead'] == 2
+    assert stats.counters['bytesRead'] == len(sig) // 2 + 100
+    assert stats.counters['indexMisses'] == 2
+    assert stats.stages['match'] > 0 and stats.elapsed > 0
+    sigIndex, seconds, checks = stats.slowest(1)[0]
+    assert scanner.signatureName(sigIndex) == 'Doc.Trojan.Layla-1'
+    assert checks == 1
+    scanner.simpleScan(tmp_path / 'scan', True)
+    assert stats.counters == {'indexHits': 2}
+
+
+def test_progressChannel(tmp_path):
+    channel = progress.ProgressChannel(interval=60)
+    for counter in range(1000):
+        channel.scanProgress(counter // 10, f'file{counter}')
+    channel.fileProgress(50)
+    assert channel.wait(0) == (99, 50, 'file999')
+    assert channel._updates.empty()
+    (tmp_path / 'scan').mkdir()
+    for counter in range(5):
+        (tmp_path / 'scan' / f'file{counter}').write_bytes(
+            b'clean%d' % counter * 20
+        )
+    scanner = tmpScanner(tmp_path / 'i.db', channel)
+    channel.abort.set()
+    scanner.simpleScan(tmp_path / 'scan', False)
+    assert scanner.aborted
+    assert 'filesRead' not in scanner.stats.counters
+    channel.reset()
+    scanner.simpleScan(tmp_path / 'scan', False)
+    assert not scanner.aborted
+    assert scanner.stats.counters['filesRead'] == 5
+
+
+def test_prefilterSkips(tmp_path):
+    (tmp_path / 'test.ndb').write_text(
+        'Long:0:*:00112233445566778899\n'
+        'PeOnly:1:*:aabbccdd\n'
+    )
+    (tmp_path / 'test.hdb').write_text(
+        '44d88612fea8a8f36de82e1278abb02f:3:Three\n'
+    )
+    base = sigBase.SigBase(tmp_path / 'test.ndb', tmp_path / 'test.hdb')
+    assert base.minBodyLen == 4 and base.targetTypes == {0, 1}
+    assert base.skipReason(0, None) == 'empty'
+    assert base.skipReason(3, None) is None
+    assert base.skipReason(2, None) == 'size'
+    assert base.skipReason(100, None) is None
+    (tmp_path / 'test.ndb').write_text('PeOnly:1:*:aabbccdd\n')
+    scanDir = tmp_path / 'scan'
+    scanDir.mkdir()
+    (scanDir / 'empty').write_bytes(b'')
+    (scanDir / 'tiny').write_bytes(b'ab')
+    (scanDir / 'text').write_bytes(b'plain text' * 10)
+    (scanDir / 'pe').write_bytes(b'MZ' + bytes(10) + b'\xaa\xbb\xcc\xdd')
+    scanner = fileManager.Scanner(
+        tmp_path / 'test.ndb', tmp_path / 'test.hdb', None, tmp_path / 'i.db'
+    )
+    scanner.simpleScan(scanDir, False)
+    report = scanner.getReport()
+    assert [info[1] for info in report[0]] == ['PeOnly']
+    assert report[3] == {'empty': 1, 'size': 1, 'type': 1}
+    assert scanner.stats.counters['filesRead'] == 1
+
+
+def test_archiveMembers(tmp_path):
+    sig = mainSig(3)
+    bad = b'x' * 100 + bytes.fromhex(sig)
+    scanDir = tmp_path / 'scan'
+    scanDir.mkdir()
+    with zipfile.ZipFile(scanDir / 'a.zip', 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('dir/bad', bad)
+        z.writestr('ok', b'clean' * 20)
+    inner = io.BytesIO()
+    with zipfile.ZipFile(inner, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('bad', bad)
+    tarData = io.BytesIO()
+    with tarfile.open(fileobj=tarData, mode='w') as archive:
+        info = tarfile.TarInfo('inner.zip')
+        info.size = len(inner.getvalue())
+        archive.addfile(info, io.BytesIO(inner.getvalue()))
+    (scanDir / 'b.tar.gz').write_bytes(gzip.compress(tarData.getvalue()))
+    scanner = tmpScanner(tmp_path / 'i.db')
+    expected = [
+        f'{scanDir}/a.zip//dir/bad',
+        f'{scanDir}/b.tar.gz//b.tar//inner.zip//bad'
+    ]
+    scanner.simpleScan(scanDir, True)
+    assert sorted(str(info[0]) for info in scanner.getReport()[1]) == \
+        expected
+    assert scanner.stats.counters['archiveMembers'] == 5
+    scanner.simpleScan(scanDir, True)
+    assert sorted(str(info[0]) for info in scanner.getReport()[1]) == \
+        expected
+    assert scanner.stats.counters == {'indexHits': 2}
+    scanner.archiveDepth = 2
+    scanner.simpleScan(scanDir, False)
+    report = scanner.getReport()
+    assert [str(info[0]) for info in report[1]] == expected[:1]
+
+
+def test_archiveSkipsPrefilter(tmp_path):
+    bodyPath = tmp_path / 'test.ndb'
+    hashPath = tmp_path / 'test.hdb'
+    bodyPath.write_text('PeOnly:1:*:aabbccdd{200}eeff\n')
+    hashPath.write_text('')
+    scanDir = tmp_path / 'scan'
+    scanDir.mkdir()
+    member = b'MZ' + bytes.fromhex('aabbccdd') + bytes(200) + b'\xee\xff'
+    for name, method in (('type', zipfile.ZIP_STORED),
+                         ('size', zipfile.ZIP_DEFLATED)):
+        with zipfile.ZipFile(scanDir / f'{name}.zip', 'w', method) as z:
+            z.writestr('pe', member)
+    assert (scanDir / 'size.zip').stat().st_size < len(member)
+    assert (scanDir / 'type.zip').stat().st_size > len(member)
+    scanner = fileManager.Scanner(bodyPath, hashPath, None, tmp_path / 'i.db')
+    scanner.simpleScan(scanDir, False)
+    assert sorted(str(info[0]) for info in scanner.getReport()[1]) == [
+        f'{scanDir}/size.zip//pe', f'{scanDir}/type.zip//pe'
+    ]
+    assert scanner.getReport()[3] == {}
+
+
+def test_archiveReusesHead(tmp_path, monkeypatch):
+    sig = mainSig(3)
+    scanDir = tmp_path / 'scan'
+    scanDir.mkdir()
+    (scanDir / 'plain').write_bytes(b'clean' * 200)
+    with zipfile.ZipFile(scanDir / 'a.zip', 'w') as z:
+        z.writestr('bad', b'x' + bytes.fromhex(sig))
+    opened = []
+    pathOpen = Path.open
+
+    def countingOpen(path, *args, **kwargs):
+        opened.append(path.name)
+        return pathOpen(path, *args, **kwargs)
+    monkeypatch.setattr(Path, 'open', countingOpen)
+    for readers, depth in ((0, 0), (0, 3), (2, 3)):
+        scanner = tmpScanner(tmp_path / f'i{readers}{depth}.db')
+        scanner.readers = readers
+        scanner.archiveDepth = depth
+        opened.clear()
+        scanner.simpleScan(scanDir, False)
+        assert opened.count('plain') == 1
+        assert len(scanner.getReport()[1]) == int(depth > 0)
+        scanner.close()
+
+
+def test_archiveLimits(tmp_path):
+    scanDir = tmp_path / 'scan'
+    scanDir.mkdir()
+    (scanDir / 'bomb.gz').write_bytes(gzip.compress(bytes(8 << 20)))
+    with zipfile.ZipFile(scanDir / 'many.zip', 'w') as z:
+        for index in range(5):
+            z.writestr(f'member{index}', b'data' * 20)
+    scanner = tmpScanner(tmp_path / 'i.db')
+    scanner.archiveMembers = 3
+    scanner.simpleScan(scanDir, False)
+    assert scanner.getReport()[3] == {'archiveLimit': 2}
+    assert scanner.stats.counters['archiveMembers'] == 3
+
+
+def test_verdictCache(tmp_path):
+    sig = mainSig(3)
+    scanDir = tmp_path / 'scan'
+    scanDir.mkdir()
+    for index in range(4):
+        (scanDir / f'bad{index}').write_bytes(b'x' + bytes.fromhex(sig))
+        (scanDir / f'ok{index}').write_bytes(b'clean' * 20)
+    for jobs, readers in [(1, 0), (1, 2), (2, 0)]:
+        for path in tmp_path.glob('i.db*'):
+            path.unlink()
+        scanner = tmpScanner(tmp_path / 'i.db')
+        scanner.jobs = jobs
+        scanner.readers = readers
+        for fast in (False, True):
+            session = scanner.session()
+            session.simpleScan(scanDir, fast)
+            report = session.getReport()
+            spans = sorted(info[2] for info in report[0])
+            assert spans == [(1, 1 + len(sig) // 2)] * 4
+            counters = session.stats.counters
+            if jobs == 1 and readers == 0 and fast:
+                assert counters['verdictHits'] == 8
+                assert 'filesRead' not in counters
+            elif jobs == 1 and readers == 0:
+                assert counters['verdictHits'] == 6
+                assert counters['filesRead'] == 2
+            for path in scanDir.iterdir():
+                stamp = path.stat().st_mtime_ns + 1000
+                os.utime(path, ns=(stamp, stamp))
+        scanner.close()
+    verdicts = indexStore.VerdictCache(tmp_path / 'i.db', 'other', 1)
+    verdicts.purgeStale()
+    assert not verdicts.hasSize(100)
+    digests = fileManager.digestMapped(b'clean' * 20, 64, ('sha256',))
+    assert verdicts.get(digests['sha256'], 100) is None
+    verdicts.set('a' * 64, 1, None)
+    verdicts.set('b' * 64, 1, ((0, 1), 'Name'))
+    verdicts.flush()
+    assert verdicts.get('a' * 64, 1) is None
+    assert verdicts.get('b' * 64, 1) == (((0, 1), 'Name'),)
+    verdicts.close()
+    verdicts = indexStore.VerdictCache(tmp_path / 'i.db', 'other', 1)
+    assert verdicts.hasSize(1) and not verdicts.hasSize(100)
+    verdicts.close()
+
+
+def test_matchBudget(tmp_path):
+    (tmp_path / 'test.ndb').write_text('Slow:0:*:aa{0-20}aa{0-20}aa{0-20}bb\n')
+    (tmp_path / 'test.hdb').write_text('')
+    base = sigBase.SigBase(tmp_path / 'test.ndb', tmp_path / 'test.hdb')
+    fileBytes = b'\xaa' * 5000
+    assert base.bodySigInFile(fileBytes, None) is None
+    assert base.bodySigInFile(fileBytes + b'\xbb', None) == \
+        ((4937, 5001), 'Slow')
+    stream = base.openStream(len(fileBytes), None, 1e-9)
+    stream.feed(fileBytes)
+    assert stream.finish() == sigBase.timeoutMatch
+    (tmp_path / 'slow').write_bytes(fileBytes)
+    for readers in (0, 2):
+        scanner = fileManager.Scanner(
+            tmp_path / 'test.ndb', tmp_path / 'test.hdb', None,
+            tmp_path / f'i{readers}.db'
+        )
+        scanner.readers = readers
+        scanner.matchBudget = 1e-9
+        scanner.simpleScan(tmp_path / 'slow', False)
+        assert scanner.getReport()[1] == [
+            (tmp_path / 'slow', 'Heuristics Limits Exceeded MaxScanTime')
+        ]
+        assert scanner.stats.counters['matchTimeouts'] == 1
+        assert scanner.fileIndex.get(str(tmp_path / 'slow')) is None
+        scanner.matchBudget = 120.0
+        scanner.simpleScan(tmp_path / 'slow', True)
+        assert scanner.getReport()[1] == []
+        assert scanner.stats.counters['filesRead'] == 1
+        scanner.close()
+
+
+def test_resumeScan(tmp_path):
+    sig = mainSig(3)
+    scanDir = tmp_path / 'scan'
+    scanDir.mkdir()
+    for index in range(5):
+        (scanDir / f'ok{index}').write_bytes(b'clean' * 20 + bytes([index]))
+    (scanDir / 'bad').write_bytes(b'x' + bytes.fromhex(sig))
+
+    def makeScanner():
+        channel = progress.ProgressChannel()
+        scanner = tmpScanner(tmp_path / 'i.db', channel)
+        scanner.resume = True
+        return scanner
+    scanner = makeScanner()
+    scanned = []
+    scanFile = scanner.scanFile
+
+    def abortingScan(path, fast):
+        scanned.append(path)
+        if len(scanned) == 3:
+            scanner.channel.abort.set()
+        return scanFile(path, fast)
+    scanner.scanFile = abortingScan
+    scanner.simpleScan(scanDir, False)
+    assert scanner.aborted
+    scanner.close()
+    scanner = makeScanner()
+    scanner.simpleScan(scanDir, False)
+    assert not scanner.aborted
+    assert scanner.stats.counters['resumedFiles'] == 2
+    assert scanner.stats.counters['filesRead'] == 4
+    assert [info[0] for info in scanner.getReport()[0]] == [scanDir / 'bad']
+    scanner.simpleScan(scanDir, False)
+    assert 'resumedFiles' not in scanner.stats.counters
+    scanner.close()
+
+
+def test_resumeRereadsCutOffFile(tmp_path):
+    scanDir = tmp_path / 'scan'
+    scanDir.mkdir()
+    for name in ('a', 'b', 'c'):
+        (scanDir / name).write_bytes(name.encode() * 50 + b'until today')
+    (tmp_path / 'new.ndb').write_text(
+        (sigDir / 'main.ndb').read_text().rstrip('\n') +
+        '\nLate:0:*:' + b'until today'.hex() + '\n'
+    )
+    scanner = tmpScanner(tmp_path / 'i.db')
+    scanner.simpleScan(scanDir, False)
+    scanner.close()
+    channel = progress.ProgressChannel()
+    scanner = tmpScanner(tmp_path / 'i.db', channel, tmp_path / 'new.ndb')
+    scanner.resume = True
+    scanFile = scanner.scanFile
+
+    def cutOffScan(path, fast):
+        if path.name == 'c':
+            scanner.channel.abort.set()
+        return scanFile(path, fast)
+    scanner.scanFile = cutOffScan
+    scanner.simpleScan(scanDir, False)
+    assert scanner.aborted
+    scanner.scanFile = scanFile
+    scanner.channel.abort.clear()
+    scanner.simpleScan(scanDir, False)
+    assert sorted(info[0].name for info in scanner.getReport()[0]) == \
+        ['a', 'b', 'c']
+    scanner.close()
+
+
+def test_governor(tmp_path):
+    limited = governor.Governor(readLimit=4)
+    began = time.monotonic()
+    for _ in range(3):
+        limited.throttle(1 << 20)
+    assert time.monotonic() - began >= 0.2
+    shared = pickle.loads(pickle.dumps(limited.share(4)))
+    assert shared.readLimit == 1
+    shared.throttle(1)
+    sig = mainSig(3)
+    (tmp_path / 'bad').write_bytes(b'x' + bytes.fromhex(sig))
+    for jobs, readers in ((1, 0), (1, 2), (2, 0)):
+        scanner = tmpScanner(tmp_path / f'i{jobs}{readers}.db')
+        scanner.jobs = jobs
+        scanner.readers = readers
+        scanner.governor = governor.Governor(100, 19, 'idle', True)
+        scanThread = threading.Thread(
+            target=scanner.simpleScan, args=(tmp_path, False)
+        )
+        scanThread.start()
+        scanThread.join()
+        assert [info[0] for info in scanner.getReport()[0]] == \
+            [tmp_path / 'bad']
+        scanner.close()
+
+
+class CountingGovernor(governor.Governor):
+    def __init__(self):
+        super().__init__()
+        self.throttled = 0
+
+    def throttle(self, amount):
+        self.throttled += amount
+
+
+def test_throttleOncePerByte(tmp_path):
+    sig = mainSig(3)
+    scanDir = tmp_path / 'scan'
+    scanDir.mkdir()
+    (scanDir / 'bad').write_bytes(b'x' + bytes.fromhex(sig))
+    (scanDir / 'ok').write_bytes(b'clean' * 20)
+    total = sum(path.stat().st_size for path in scanDir.iterdir())
+    for readers in (0, 2):
+        scanner = tmpScanner(tmp_path / f'i{readers}.db')
+        scanner.readers = readers
+        for fast, content in ((False, b'clean'), (True, b'dirty')):
+            (scanDir / 'ok').write_bytes(content * 20)
+            for path in scanDir.iterdir():
+                stamp = path.stat().st_mtime_ns + 1000
+                os.utime(path, ns=(stamp, stamp))
+            scanner.governor = CountingGovernor()
+            scanner.simpleScan(scanDir, fast)
+            assert scanner.governor.throttled == total
+        assert scanner.stats.counters['verdictMisses'] == 1
+        scanner.close()
+
+
+def test_rollingSlices(tmp_path):
+    assert fileManager.rollingSlice(4, 100, 130) == 1
+    assert fileManager.untilNextSlice(4, 100, 130) == 20
+    sig = mainSig(3)
+    scanDir = tmp_path / 'scan'
+    scanDir.mkdir()
+    for index in range(8):
+        (scanDir / f'ok{index}').write_bytes(b'clean' * 20 + bytes([index]))
+    (scanDir / 'bad').write_bytes(b'x' + bytes.fromhex(sig))
+    scanner = tmpScanner(tmp_path / 'i.db')
+    scanner.simpleScan(scanDir, True)
+    rescanned = 0
+    for shard in range(4):
+        scanner.rolling = (shard, 4)
+        changed = [
+            path for path in scanDir.iterdir()
+            if path.name.startswith('ok') and not scanner.inSlice(path)
+        ][0]
+        os.utime(changed, ns=(0, shard + 1))
+        scanner.simpleScan(scanDir, True)
+        counters = scanner.stats.counters
+        rescanned += counters.get('sliceRescans', 0)
+        assert counters['indexMisses'] == counters.get('sliceRescans', 0) + 1
+        assert [info[0] for info in scanner.getReport()[0]] == \
+            [scanDir / 'bad']
+    assert rescanned == 9
+    scanner.close()
+
+
+def test_sliceRescanStoresNewResult(tmp_path):
+    scanDir = tmp_path / 'scan'
+    scanDir.mkdir()
+    (scanDir / 'late').write_bytes(b'harmless until today' * 4)
+    (tmp_path / 'new.ndb').write_text(
+        (sigDir / 'main.ndb').read_text().rstrip('\n') +
+        '\nLate:0:*:' + b'until today'.hex() + '\n'
+    )
+    scanner = tmpScanner(tmp_path / 'i.db')
+    scanner.simpleScan(scanDir, True)
+    assert scanner.getReport()[0] == []
+    scanner.close()
+    scanner = tmpScanner(tmp_path / 'i.db', bodyPath=tmp_path / 'new.ndb')
+    scanner.rolling = (0, 1)
+    scanner.simpleScan(scanDir, True)
+    assert scanner.stats.counters['sliceRescans'] == 1
+    assert [info[1] for info in scanner.getReport()[0]] == ['Late']
+    scanner.rolling = None
+    scanner.simpleScan(scanDir, True)
+    assert scanner.stats.counters['indexHits'] == 1
+    assert [info[1] for info in scanner.getReport()[0]] == ['Late']
+    scanner.close()
@@ -0,0 +1,292 @@
+import sigBase
+import bz2
+import gzip
+import lzma
+import tarfile
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+
+archiveErrors = (
+    OSError,
+    EOFError,
+    RuntimeError,
+    ValueError,
+    NotImplementedError,
+    zipfile.BadZipFile,
+    tarfile.TarError,
+    lzma.LZMAError,
+    zlib.error
+)
+headSize = 512
+streamTypes = {
+    'gzip': lambda fileObj: gzip.GzipFile(fileobj=fileObj),
+    'bz2': bz2.BZ2File,
+    'xz': lzma.LZMAFile
+}
+
+
+def containerType(head):
+    if head.startswith((b'PK\x03\x04', b'PK\x05\x06')):
+        return 'zip'
+    if head.startswith(b'\x1f\x8b'):
+        return 'gzip'
+    if head.startswith(b'BZh'):
+        return 'bz2'
+    if head.startswith(b'\xfd7zXZ\x00'):
+        return 'xz'
+    if head[257:262] == b'ustar':
+        return 'tar'
+    return None
+
+
+class ArchiveLimit(Exception):
+    pass
+
+
+class Budget():
+    def __init__(self, limit):
+        self.remaining = limit
+        self._lock = threading.Lock()
+
+    def charge(self, amount):
+        with self._lock:
+            self.remaining -= amount
+            if self.remaining < 0:
+                raise ArchiveLimit()
+
+
+class LimitedReader():
+    def __init__(self, stream, limit, budget, parent=None):
+        self._stream = stream
+        self._parent = parent
+        self.limit = limit
+        self.budget = budget
+
+    def read(self, size=-1):
+        room = self.limit - self._stream.tell() + 1
+        if size < 0 or size > room:
+            size = room
+        data = self._stream.read(size)
+        self.budget.charge(len(data))
+        if self._stream.tell() > self.limit:
+            raise ArchiveLimit()
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 2:
+            before = self._stream.tell()
+            position = self._stream.seek(offset, whence)
+            if position > self.limit:
+                raise ArchiveLimit()
+            self.budget.charge(max(position - before, 0))
+            return position
+        if whence == 1:
+            offset += self._stream.tell()
+        if offset > self.limit:
+            raise ArchiveLimit()
+        if (ahead := offset - self._stream.tell()) > 0:
+            self.budget.charge(ahead)
+        return self._stream.seek(offset)
+
+    def tell(self):
+        return self._stream.tell()
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self._stream.close()
+        if self._parent is not None:
+            self._parent.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+        return False
+
+
+class ArchiveResult():
+    def __init__(self):
+        self.members = []
+        self.scanned = 0
+        self.limits = 0
+        self.errors = 0
+
+    def merge(self, other):
+        self.members.extend(other.members)
+        self.scanned += other.scanned
+        self.limits += other.limits
+        self.errors += other.errors
+
+    def asEntry(self):
+        return {
+            'members': self.members,
+            'scanned': self.scanned,
+            'limits': self.limits,
+            'errors': self.errors
+        }
+
+
+class ArchiveScanner():
+    minLimit = 1 << 20
+
+    def __init__(self, signatures, chunkSize, maxDepth, maxMembers,
+                 maxRatio, jobs=1, matchBudget=None, governor=None):
+        self.signatures = signatures
+        self.chunkSize = chunkSize
+        self.maxDepth = maxDepth
+        self.maxMembers = maxMembers
+        self.maxRatio = maxRatio
+        self.jobs = jobs
+        self.matchBudget = matchBudget
+        self.governor = governor
+        self._budget = None
+
+    def limit(self, packedSize):
+        return max(packedSize * self.maxRatio, self.minLimit)
+
+    def scan(self, path, head=None):
+        if self.maxDepth < 1:
+            return None
+        if head is None:
+            with path.open('rb') as fileObj:
+                head = fileObj.read(headSize)
+                if self.governor is not None:
+                    self.governor.closing(fileObj)
+        if (kind := containerType(head)) is None:
+            return None
+        size = path.stat().st_size
+        self._budget = Budget(self.limit(size))
+        opener = path.open
+        result = self.scanContainer(
+            kind, lambda: opener('rb'), size, str(path), 1
+        )
+        if self.governor is not None:
+            self.governor.forget(path)
+        return result.asEntry()
+
+    def scanContainer(self, kind, opener, packedSize, display, depth):
+        result = ArchiveResult()
+        try:
+            if kind in streamTypes:
+                self.scanStream(kind, opener, packedSize, display, depth,
+                                result)
+            else:
+                with opener() as fileObj:
+                    if kind == 'zip':
+                        self.scanZip(fileObj, display, depth, result)
+                    else:
+                        self.scanTar(fileObj, display, depth, result)
+        except ArchiveLimit:
+            result.limits += 1
+        except archiveErrors:
+            result.errors += 1
+        return result
+
+    def scanZip(self, fileObj, display, depth, result):
+        with zipfile.ZipFile(fileObj) as archive:
+            infos = [info for info in archive.infolist() if not info.is_dir()]
+            if len(infos) > self.maxMembers:
+                infos = infos[:self.maxMembers]
+                result.limits += 1
+
+            def memberOpener(info):
+                limit = self.limit(info.compress_size)
+                return lambda: LimitedReader(
+                    archive.open(info), limit, self._budget
+                )
+            tasks = [
+                (
+                    f'{display}//{info.filename}',
+                    info.file_size,
+                    memberOpener(info),
+                    depth
+                )
+                for info in infos
+            ]
+            if depth == 1 and self.jobs > 1 and len(tasks) > 1:
+                with ThreadPoolExecutor(self.jobs) as pool:
+                    for partial in pool.map(
+                        lambda task: self.scanMember(*task), tasks
+                    ):
+                        result.merge(partial)
+            else:
+                for task in tasks:
+                    result.merge(self.scanMember(*task))
+
+    def scanTar(self, fileObj, display, depth, result):
+        with tarfile.open(fileobj=fileObj, mode='r:') as archive:
+            count = 0
+            for member in archive:
+                if not member.isfile():
+                    continue
+                count += 1
+                if count > self.maxMembers:
+                    result.limits += 1
+                    break
+                result.merge(self.scanMember(
+                    f'{display}//{member.name}',
+                    member.size,
+                    lambda member=member: archive.extractfile(member),
+                    depth
+                ))
+
+    def scanStream(self, kind, opener, packedSize, display, depth, result):
+        name = PurePosixPath(display.rsplit('//', 1)[-1]).stem or 'data'
+        limit = self.limit(packedSize)
+
+        def memberOpener():
+            parent = opener()
+            stream = streamTypes[kind](parent)
+            return LimitedReader(stream, limit, self._budget, parent)
+        result.merge(
+            self.scanMember(f'{display}//{name}', None, memberOpener, depth)
+        )
+
+    def scanMember(self, display, size, opener, depth):
+        result = ArchiveResult()
+        try:
+            head, size = self.scanData(display, size, opener, result)
+            kind = containerType(head)
+            if kind is not None and depth < self.maxDepth:
+                result.merge(
+                    self.scanContainer(kind, opener, size, display, depth + 1)
+                )
+        except ArchiveLimit:
+            result.limits += 1
+        except archiveErrors:
+            result.errors += 1
+        return result
+
+    def scanData(self, display, size, opener, result):
+        if size is not None and self.signatures.skipReason(size, None):
+            return b'', size
+        fileHash = sigBase.MultiHash(self.signatures.digestsFor(size))
+        stream = self.signatures.openStream(size, None, self.matchBudget)
+        head = b''
+        done = 0
+        with opener() as memberFile:
+            while (chunk := memberFile.read(self.chunkSize)):
+                if self.governor is not None:
+                    self.governor.throttle(len(chunk))
+                if not head:
+                    head = chunk[:512]
+                done += len(chunk)
+                fileHash.update(chunk)
+                stream.feed(chunk)
+        bodyMatch = stream.finish()
+        scanResult = self.signatures.scanFile(
+            fileHash.hexdigests(), done, bodyMatch
+        )[0]
+        result.scanned += 1
+        if scanResult is not None and scanResult[0]:
+            result.members.append([display, scanResult[2]])
+        return head, done
@@ -0,0 +1,274 @@
+import fileManager
+import indexStore
+import sigBase
+import argparse
+import hashlib
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+
+def writeSignatures(directory, bodyCount, hashCount, rng):
+    bodyPath = Path(directory) / 'bench.ndb'
+    hashPath = Path(directory) / 'bench.hdb'
+    with open(bodyPath, 'w') as sigFile:
+        for index in range(bodyCount):
+            sig = rng.randbytes(rng.randint(16, 64)).hex()
+            sigFile.write(f'Bench.Body-{index}:0:*:{sig}\n')
+    with open(hashPath, 'w') as sigFile:
+        for index in range(hashCount):
+            digest = rng.randbytes(16).hex()
+            size = rng.randint(1, 1 << 20)
+            sigFile.write(f'{digest}:{size}:Bench.Hash-{index}\n')
+    return bodyPath, hashPath
+
+
+def makeSmallFiles(root, count, size, rng):
+    root.mkdir(parents=True)
+    for index in range(count):
+        (root / f'small{index}').write_bytes(rng.randbytes(size))
+
+
+def makeHugeFiles(root, count, size, rng):
+    root.mkdir(parents=True)
+    block = rng.randbytes(1 << 20)
+    for index in range(count):
+        with open(root / f'huge{index}', 'wb') as fileObj:
+            for written in range(0, size, len(block)):
+                fileObj.write(block[:size - written])
+
+
+def makeDeepTree(root, depth, width, filesPerDir):
+    level = [root]
+    for current in range(depth + 1):
+        nextLevel = []
+        for directory in level:
+            directory.mkdir(parents=True)
+            for index in range(filesPerDir):
+                (directory / f'leaf{index}').write_bytes(b'leaf')
+            if current < depth:
+                nextLevel.extend(
+                    directory / f'dir{index}' for index in range(width)
+                )
+        level = nextLevel
+
+
+def corpusSize(root):
+    files = [path for path in root.rglob('*') if path.is_file()]
+    return len(files), sum(path.stat().st_size for path in files)
+
+
+def measure(func, byteCount, fileCount):
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    seconds = max(seconds, 1e-9)
+    return {
+        'seconds': seconds,
+        'mbPerSec': byteCount / seconds / (1 << 20),
+        'filesPerSec': fileCount / seconds,
+        'files': fileCount,
+        'bytes': byteCount,
+        'peakMemory': peak
+    }
+
+
+def matchFiles(signatures, paths, chunkSize):
+    for path in paths:
+        size = path.stat().st_size
+        readResult = fileManager.readFile(
+            signatures, path, size, chunkSize, (), None
+        )
+        signatures.scanFile(None, size, readResult[1])
+
+
+def hashFiles(paths, chunkSize):
+    for path in paths:
+        fileHash = hashlib.md5()
+        with open(path, 'rb') as fileObj:
+            while (chunk := fileObj.read(chunkSize)):
+                fileHash.update(chunk)
+        fileHash.hexdigest()
+
+
+def scanTree(bodyPath, hashPath, root, work):
+    counter = [0]
+
+    def scan():
+        counter[0] += 1
+        indexPath = work / f'scan{counter[0]}.db'
+        scanner = fileManager.Scanner(bodyPath, hashPath, None, indexPath)
+        scanner.simpleScan(root, False)
+        scanner.close()
+    return scan
+
+
+def indexSave(work, entries):
+    counter = [0]
+
+    def save():
+        counter[0] += 1
+        index = indexStore.openIndex(work / f'save{counter[0]}.db')
+        for path, entry in entries:
+            index.set(path, entry)
+        index.close()
+    return save
+
+
+def indexLoad(indexPath, entries):
+    def load():
+        index = indexStore.openIndex(indexPath)
+        for path, entry in entries:
+            index.get(path)
+        index.close()
+    return load
+
+
+def gitVersion():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def runBenchmarks(config, work):
+    rng = random.Random(config['seed'])
+    work = Path(work)
+    bodyPath, hashPath = writeSignatures(
+        work, config['bodySigs'], config['hashSigs'], rng
+    )
+    corpus = work / 'corpus'
+    makeSmallFiles(
+        corpus / 'small', config['smallFiles'], config['smallSize'], rng
+    )
+    makeHugeFiles(
+        corpus / 'huge', config['hugeFiles'], config['hugeSize'] << 20, rng
+    )
+    tree = work / 'tree'
+    makeDeepTree(tree, config['depth'], config['width'], config['perDir'])
+    paths = sorted(path for path in corpus.rglob('*') if path.is_file())
+    fileCount, byteCount = corpusSize(corpus)
+    treeFiles = corpusSize(tree)[0]
+    chunkSize = config['chunk'] << 10
+    signatures = sigBase.SigBase(bodyPath, hashPath, False)
+    entries = [
+        (f'/bench/{index}', {'stat': [index] * 4, 'result': [False, None]})
+        for index in range(config['indexEntries'])
+    ]
+    loadPath = work / 'load.db'
+    indexSave(work, entries)()
+    (work / 'save1.db').rename(loadPath)
+    sigBytes = bodyPath.stat().st_size + hashPath.stat().st_size
+    scanner = fileManager.Scanner(bodyPath, hashPath, None, work / 'w.db')
+    stages = {
+        'sigLoad': (
+            lambda: sigBase.SigBase(bodyPath, hashPath, False),
+            sigBytes,
+            0
+        ),
+        'match': (
+            lambda: matchFiles(signatures, paths, chunkSize),
+            byteCount,
+            fileCount
+        ),
+        'hash': (
+            lambda: hashFiles(paths, chunkSize),
+            byteCount,
+            fileCount
+        ),
+        'findFiles': (
+            lambda: list(scanner.findFiles(tree)),
+            0,
+            treeFiles
+        ),
+        'scan': (
+            scanTree(bodyPath, hashPath, corpus, work),
+            byteCount,
+            fileCount
+        ),
+        'indexSave': (indexSave(work, entries), 0, len(entries)),
+        'indexLoad': (indexLoad(loadPath, entries), 0, len(entries))
+    }
+    results = {}
+    for name, (func, stageBytes, stageFiles) in stages.items():
+        if config['only'] and name not in config['only']:
+            continue
+        results[name] = measure(func, stageBytes, stageFiles)
+    scanner.close()
+    return results
+
+
+def compare(results, baseline):
+    lines = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['seconds'] / max(baseline[name]['seconds'], 1e-9)
+        lines.append(f'{name:<10} {ratio:6.2f}x time vs baseline')
+    return lines
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-output', default='benchmark.json', metavar='PATH')
+    parser.add_argument('-compare', metavar='PATH',
+                        help='earlier results to compare against')
+    parser.add_argument('-seed', type=int, default=0)
+    parser.add_argument('-bodySigs', type=int, default=1000)
+    parser.add_argument('-hashSigs', type=int, default=10000)
+    parser.add_argument('-smallFiles', type=int, default=2000)
+    parser.add_argument('-smallSize', type=int, default=4096,
+                        metavar='BYTES')
+    parser.add_argument('-hugeFiles', type=int, default=2)
+    parser.add_argument('-hugeSize', type=int, default=16, metavar='MB')
+    parser.add_argument('-depth', type=int, default=6)
+    parser.add_argument('-width', type=int, default=3)
+    parser.add_argument('-perDir', type=int, default=2)
+    parser.add_argument('-indexEntries', type=int, default=20000)
+    parser.add_argument('-chunk', type=int, default=1024, metavar='KB')
+    parser.add_argument('-only', nargs='*', default=[], metavar='STAGE')
+    args = parser.parse_args(arguments)
+    config = vars(args).copy()
+    del config['output'], config['compare']
+    with tempfile.TemporaryDirectory() as work:
+        results = runBenchmarks(config, work)
+    for name, result in results.items():
+        print(
+            f'{name:<10} {result["seconds"]:8.3f}s '
+            f'{result["mbPerSec"]:8.1f} MB/s '
+            f'{result["filesPerSec"]:10.1f} files/s '
+            f'{result["peakMemory"] / (1 << 20):8.1f} MB peak'
+        )
+    if args.compare:
+        with open(args.compare) as baselineFile:
+            baseline = json.load(baselineFile)['results']
+        print('\n'.join(compare(results, baseline)))
+    with open(args.output, 'w') as outFile:
+        json.dump({
+            'version': gitVersion(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': config,
+            'results': results
+        }, outFile, indent=4)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
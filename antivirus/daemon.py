@@ -0,0 +1,97 @@
+import indexStore
+import json
+import os
+import socket
+import socketserver
+from pathlib import Path
+
+
+def encodeReport(report, fixed):
+    return {
+        'fixable': [
+            [str(path), name, list(span)] for path, name, span in report[0]
+        ],
+        'unfixable': [[str(path), name] for path, name in report[1]],
+        'denied': [str(path) for path in report[2]],
+        'skipped': report[3],
+        'fixed': fixed
+    }
+
+
+def decodeReport(reply):
+    report = (
+        [(path, name, tuple(span)) for path, name, span in reply['fixable']],
+        [(path, name) for path, name in reply['unfixable']],
+        reply['denied'],
+        reply['skipped']
+    )
+    return report, reply['fixed']
+
+
+class ScanHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = self.server.scan(json.loads(line))
+            except (ValueError, KeyError, TypeError) as error:
+                reply = {'error': f'bad request: {error}'}
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+            self.wfile.flush()
+
+
+class ScanServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socketPath, scanner):
+        self.socketPath = str(socketPath)
+        self.scanner = scanner
+        scanner.checkpointInterval = 0
+        scanner.fileIndex = indexStore.SharedIndex(scanner.fileIndex)
+        if os.path.exists(self.socketPath):
+            os.unlink(self.socketPath)
+        oldMask = os.umask(0o177)
+        try:
+            super().__init__(self.socketPath, ScanHandler)
+        finally:
+            os.umask(oldMask)
+
+    def scan(self, request):
+        path = Path(request['path'])
+        if not path.is_absolute() or not path.exists():
+            return {'error': 'Path invalid'}
+        session = self.scanner.session()
+        session.simpleScan(path, request.get('fast', True))
+        report = session.getReport()
+        fixed = None
+        if request.get('cut', False):
+            fixed = [
+                str(fixable[0]) for fixable in report[0]
+                if session.cutOut(fixable)
+            ]
+        return encodeReport(report, fixed)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socketPath):
+            os.unlink(self.socketPath)
+        self.scanner.close()
+
+
+def serve(socketPath, scanner):
+    with ScanServer(socketPath, scanner) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def requestScan(socketPath, path, fast, cut):
+    request = {'path': str(Path(path).resolve()), 'fast': fast, 'cut': cut}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(socketPath))
+        client.sendall(json.dumps(request).encode() + b'\n')
+        with client.makefile('rb') as replies:
+            reply = json.loads(replies.readline())
+    if 'error' in reply:
+        raise ValueError(reply['error'])
+    return decodeReport(reply)
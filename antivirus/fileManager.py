@@ -1,135 +1,1008 @@
 import sigBase
-import hashlib
-import json
+import archives
+import governor
+import indexStore
+import scanStats
+import copy
+import itertools
+import mmap
+import os
+import queue
+import random
+import stat
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
+_workerState = {}
+defaultGovernor = governor.Governor()
+
+
+def mapFile(fileObj, fileSize):
+    if fileSize == 0 or not stat.S_ISREG(os.fstat(fileObj.fileno()).st_mode):
+        return None
+    try:
+        return mmap.mmap(fileObj.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+
+def readMapped(stream, fileHash, mapped, chunkSize, channel, times,
+               governor):
+    with memoryview(mapped) as view:
+        for start in range(0, len(mapped), chunkSize):
+            end = min(start + chunkSize, len(mapped))
+            governor.throttle(end - start)
+            began = time.perf_counter()
+            if fileHash is not None:
+                fileHash.update(view[start:end])
+            hashed = time.perf_counter()
+            stream.feedRange(mapped, start, end)
+            times['hash'] += hashed - began
+            times['match'] += time.perf_counter() - hashed
+            if channel is not None:
+                channel.fileProgress((end*100)//len(mapped))
+                if channel.abort.is_set():
+                    return False
+    return True
+
+
+def readBuffered(stream, fileHash, fileObj, fileSize, chunkSize, channel,
+                 times, governor):
+    done = 0
+    while True:
+        began = time.perf_counter()
+        if not (chunk := fileObj.read(chunkSize)):
+            break
+        read = time.perf_counter()
+        governor.throttle(len(chunk))
+        if fileHash is not None:
+            fileHash.update(chunk)
+        hashed = time.perf_counter()
+        stream.feed(chunk)
+        times['read'] += read - began
+        times['hash'] += hashed - read
+        times['match'] += time.perf_counter() - hashed
+        done += len(chunk)
+        if channel is not None:
+            channel.fileProgress((done*100)//max(fileSize, done))
+            if channel.abort.is_set():
+                return False
+    return True
+
+
+def containerHead(head, fileSize):
+    head = bytes(head[:archives.headSize])
+    if len(head) < min(archives.headSize, fileSize):
+        return None
+    return head
+
+
+def digestMapped(mapped, chunkSize, algorithms, governor=defaultGovernor):
+    fileHash = sigBase.MultiHash(algorithms)
+    with memoryview(mapped) as view:
+        for start in range(0, len(mapped), chunkSize):
+            chunk = view[start:start+chunkSize]
+            governor.throttle(len(chunk))
+            fileHash.update(chunk)
+    return fileHash.hexdigests()
+
+
+def lookupMapped(verdicts, mapped, fileSize, chunkSize, algorithms, stats,
+                 governor):
+    if 'sha256' not in algorithms:
+        algorithms = ('sha256', *algorithms)
+    began = time.perf_counter()
+    digests = digestMapped(mapped, chunkSize, algorithms, governor)
+    cached = verdicts.get(digests['sha256'], fileSize)
+    if stats is not None:
+        stats.add(hash=time.perf_counter() - began)
+        if cached is None:
+            stats.count(verdictMisses=1)
+        else:
+            stats.count(verdictHits=1)
+    return digests, cached
+
+
+def cachedRead(verdicts, toScan, fileSize, chunkSize, algorithms, stats,
+               governor=defaultGovernor):
+    with toScan.open('rb') as fileObj:
+        if (mapped := mapFile(fileObj, fileSize)) is None:
+            return None
+        governor.opened(fileObj)
+        with mapped:
+            governor.mapped(mapped)
+            args = (
+                verdicts, mapped, fileSize, chunkSize, algorithms, stats,
+                governor
+            )
+            digests, cached = lookupMapped(*args)
+            head = containerHead(mapped, fileSize)
+        if cached is not None:
+            governor.closing(fileObj)
+    return digests, cached, head
+
+
+def readFile(signatures, toScan, fileSize, chunkSize, algorithms, channel,
+             stats=None, verdicts=None, budget=None,
+             governor=defaultGovernor):
+    fileHash = sigBase.MultiHash(algorithms) if algorithms else None
+    digests = None
+    stream = signatures.openStream(fileSize, stats, budget)
+    times = {'read': 0.0, 'hash': 0.0, 'match': 0.0}
+    began = time.perf_counter()
+    with toScan.open('rb') as fileObj:
+        governor.opened(fileObj)
+        try:
+            if (mapped := mapFile(fileObj, fileSize)) is not None:
+                times['read'] += time.perf_counter() - began
+                with mapped:
+                    governor.mapped(mapped)
+                    if verdicts is not None:
+                        args = (
+                            verdicts, mapped, fileSize, chunkSize,
+                            algorithms, stats, governor
+                        )
+                        digests, cached = lookupMapped(*args)
+                        if cached is not None:
+                            head = containerHead(mapped, fileSize)
+                            return digests, cached[0], head
+                        fileHash = None
+                    args = (
+                        stream, fileHash, mapped, chunkSize, channel, times,
+                        governor if digests is None else defaultGovernor
+                    )
+                    if not readMapped(*args):
+                        return None
+            else:
+                times['read'] += time.perf_counter() - began
+                args = (
+                    stream, fileHash, fileObj, fileSize, chunkSize, channel,
+                    times, governor
+                )
+                if not readBuffered(*args):
+                    return None
+        finally:
+            governor.closing(fileObj)
+        began = time.perf_counter()
+        bodyMatch = stream.finish()
+        times['match'] += time.perf_counter() - began
+    if fileHash is not None:
+        digests = fileHash.hexdigests()
+    if stats is not None:
+        stats.add(**times)
+        stats.count(
+            filesRead=1,
+            bytesRead=fileSize,
+            mappedFiles=int(mapped is not None)
+        )
+    return digests, bodyMatch, containerHead(stream.head, fileSize)
+
+
+def defaultShards(period):
+    return max(1, min(int(period // 60), 60))
+
+
+def rollingSlice(shards, period, moment=None):
+    if moment is None:
+        moment = time.time()
+    return int(moment * shards // period) % shards
+
+
+def untilNextSlice(shards, period, moment=None):
+    if moment is None:
+        moment = time.time()
+    tick = period / shards
+    return tick - moment % tick
+
+
+def scanArchive(signatures, toScan, chunkSize, limits, jobs, budget=None,
+                governor=defaultGovernor, head=None):
+    scanner = archives.ArchiveScanner(
+        signatures, chunkSize, *limits, jobs, budget, governor
+    )
+    try:
+        return scanner.scan(toScan, head)
+    except OSError:
+        return None
+
+
+def initWorker(bodySigPath, hashSigPath, chunkSize, archiveLimits,
+               verdictArgs, matchBudget, governor):
+    governor.applyPriority()
+    _workerState['signatures'] = sigBase.SigBase(bodySigPath, hashSigPath)
+    _workerState['chunkSize'] = chunkSize
+    _workerState['archiveLimits'] = archiveLimits
+    _workerState['matchBudget'] = matchBudget
+    _workerState['governor'] = governor
+    _workerState['verdicts'] = None
+    if verdictArgs is not None:
+        _workerState['verdicts'] = indexStore.VerdictCache(*verdictArgs)
+
+
+def scanWorker(toScan, fileSize, algorithms, prehash):
+    stats = scanStats.ScanStats()
+    args = (
+        _workerState['signatures'],
+        toScan,
+        fileSize,
+        _workerState['chunkSize'],
+        algorithms,
+        None,
+        stats,
+        _workerState['verdicts'] if prehash else None,
+        _workerState['matchBudget'],
+        _workerState['governor']
+    )
+    try:
+        readResult = readFile(*args)
+    except FileNotFoundError:
+        return None, None, stats
+    except OSError:
+        return 'denied', None, stats
+    archive = scanArchive(
+        _workerState['signatures'],
+        toScan,
+        _workerState['chunkSize'],
+        _workerState['archiveLimits'],
+        1,
+        _workerState['matchBudget'],
+        _workerState['governor'],
+        readResult[2]
+    )
+    return readResult, archive, stats
 
 
 class Scanner():
-    def clearDeleted(self):
-        files = [Path(path) for path in self.fileIndex.keys]
-        toDelete = []
-        for path in files:
-            if not path.exists():
-                toDelete.append(str(path))
-        for path in toDelete:
-            del self.fileIndex[path]
-
-    def __init__(self, bodySigPath, hashSigPath, callbacks):
+    def clearDeleted(self, prefix=''):
+        for path in self.fileIndex.paths(prefix):
+            if not Path(path).exists():
+                self.fileIndex.delete(path)
+        self.fileIndex.flush()
+
+    def __init__(self, bodySigPath, hashSigPath, channel,
+                 indexPath='index.db'):
         self.aborted = False
-        self.callbacks = callbacks
+        self.paranoid = 0
+        self.chunkSize = 1 << 20
+        self.jobs = 1
+        self.readers = 0
+        self.archiveDepth = 3
+        self.archiveMembers = 10000
+        self.archiveRatio = 100
+        self.archiveJobs = 4
+        self.matchBudget = 120.0
+        self.resume = False
+        self.rolling = None
+        self.checkpointInterval = 30.0
+        self.checkpoint = None
+        self._checkpointed = 0.0
+        self.governor = governor.Governor()
+        self.indexLock = threading.Lock()
+        self.channel = channel
         self.report = ScanReport()
+        self.stats = scanStats.ScanStats()
+        self._sigPaths = (bodySigPath, hashSigPath)
+        began = time.perf_counter()
         self._signatures = sigBase.SigBase(bodySigPath, hashSigPath)
-        try:
-            with open('index.json') as jsonIndex:
-                self.fileIndex = json.load(jsonIndex)
-        except FileNotFoundError:
-            with open('index.json', 'w') as jsonIndex:
-                self.fileIndex = {}
-                json.dump(self.fileIndex, jsonIndex)
+        self.stats.sigLoad = time.perf_counter() - began
+        self.stats.sigCache = self._signatures.fromCache
+        self.fileIndex = indexStore.openIndex(indexPath)
+        self.verdicts = None
+        self._verdictPath = indexStore.verdictPath(indexPath)
+        self._checkpointPath = indexStore.checkpointPath(indexPath)
+        self.setVerdictCache(100000)
+
+    def session(self):
+        session = copy.copy(self)
+        session.aborted = False
+        session.checkpoint = None
+        session.report = ScanReport()
+        session.stats = scanStats.ScanStats()
+        session.stats.sigLoad = self.stats.sigLoad
+        session.stats.sigCache = self.stats.sigCache
+        return session
+
+    def signatureName(self, sigIndex):
+        return self._signatures.bodySignatures[sigIndex].malwareName
+
+    def setVerdictCache(self, capacity):
+        if self.verdicts is not None:
+            self.verdicts.close()
+            self.verdicts = None
+        if capacity > 0:
+            self.verdicts = indexStore.VerdictCache(
+                self._verdictPath, self._signatures.version, capacity
+            )
+            self.verdicts.purgeStale()
+
+    def verdictArgs(self):
+        if self.verdicts is None:
+            return None
+        return self._verdictPath, self.verdicts.version, self.verdicts.capacity
+
+    def close(self):
+        self.fileIndex.close()
+        if self.verdicts is not None:
+            self.verdicts.close()
 
     def updateIndex(self):
-        with open('index.json', 'w') as jsonIndex:
-            json.dump(self.fileIndex, jsonIndex, indent=4)
+        began = time.perf_counter()
+        self.fileIndex.flush()
+        if self.verdicts is not None:
+            self.verdicts.flush()
+        self.stats.add(store=time.perf_counter() - began)
 
-    def scanFile(self, toScan, fast):
-        strToScan = str(toScan)
+    @staticmethod
+    def statKey(fileStat):
+        return [
+            fileStat.st_size,
+            fileStat.st_mtime_ns,
+            fileStat.st_ino,
+            fileStat.st_dev
+        ]
+
+    def reportIndexed(self, toScan, fileInfo):
+        scanResult = fileInfo['result']
+        if not scanResult[0] and fileInfo.get('digests'):
+            args = fileInfo['digests'], fileInfo['stat'][0], None
+            if (hashResult := self._signatures.scanFile(*args)[0])[0]:
+                scanResult = fileInfo['result'] = list(hashResult)
+                self.fileIndex.set(str(toScan), fileInfo)
+                self.stats.count(digestHits=1)
+        if scanResult[0]:
+            if len(scanResult) == 4:
+                args = toScan, scanResult[2], scanResult[3]
+                self.report.addFixable(*args)
+            else:
+                self.report.addUnfixable(toScan, scanResult[2])
+        self.reportArchive(fileInfo.get('archive'))
+
+    def reportArchive(self, archive):
+        if archive is None:
+            return
+        for memberPath, name in archive['members']:
+            self.report.addUnfixable(memberPath, name)
+        if archive['limits']:
+            self.report.addSkipped('archiveLimit', archive['limits'])
+        if archive['errors']:
+            self.report.addSkipped('archiveError', archive['errors'])
+
+    def archiveLimits(self):
+        return self.archiveDepth, self.archiveMembers, self.archiveRatio
+
+    def scanArchive(self, toScan, head=None):
+        args = (
+            self._signatures,
+            toScan,
+            self.chunkSize,
+            self.archiveLimits(),
+            self.archiveJobs,
+            self.matchBudget,
+            self.governor,
+            head
+        )
+        return scanArchive(*args)
+
+    def readFile(self, toScan, fileSize, algorithms, prehash):
+        args = (
+            self._signatures,
+            toScan,
+            fileSize,
+            self.chunkSize,
+            algorithms,
+            self.channel,
+            self.stats,
+            self.verdicts if prehash else None,
+            self.matchBudget,
+            self.governor
+        )
+        return readFile(*args)
+
+    def cachedRead(self, toScan, fileSize, algorithms):
+        args = (
+            self.verdicts,
+            toScan,
+            fileSize,
+            self.chunkSize,
+            algorithms,
+            self.stats,
+            self.governor
+        )
         try:
-            fileBytes = toScan.read_bytes()
-        except PermissionError:
+            return cachedRead(*args)
+        except OSError:
+            return None
+
+    def openStream(self, fileSize):
+        return self._signatures.openStream(
+            fileSize, self.stats, self.matchBudget
+        )
+
+    def verdictCached(self, fileSize):
+        return self.verdicts is not None and self.verdicts.hasSize(fileSize)
+
+    def hashAlgorithms(self, fileSize, fileInfo):
+        algorithms = self._signatures.digestsFor(fileSize)
+        if self.verdicts is None or 'sha256' in algorithms:
+            return algorithms
+        return ('sha256', *algorithms)
+
+    def indexState(self, toScan, fast):
+        began = time.perf_counter()
+        state = self.lookupIndex(toScan, fast)
+        self.stats.add(index=time.perf_counter() - began)
+        if state is not None:
+            counter = {
+                'denied': 'denied',
+                'indexed': 'indexHits',
+                'scan': 'indexMisses'
+            }[state[0]]
+            self.stats.count(**{counter: 1})
+        return state
+
+    def lookupIndex(self, toScan, fast):
+        try:
+            statKey = self.statKey(toScan.stat())
+        except FileNotFoundError:
+            return None
+        except OSError:
+            return ('denied',)
+        resumed = self.checkpoint is not None and \
+            self.checkpoint.isDone(str(toScan))
+        fileInfo = self.fileIndex.get(str(toScan)) \
+            if fast or resumed else None
+        if not isinstance(fileInfo, dict):
+            fileInfo = None
+        elif fileInfo['stat'] == statKey:
+            if resumed:
+                self.stats.count(resumedFiles=1)
+                return ('indexed', fileInfo)
+            if not self.dueForRescan(toScan):
+                return ('indexed', fileInfo)
+        return ('scan', statKey, fileInfo)
+
+    def inSlice(self, toScan):
+        shard, shards = self.rolling
+        return zlib.crc32(os.fsencode(toScan)) % shards == shard
+
+    def dueForRescan(self, toScan):
+        if self.rolling is not None and self.inSlice(toScan):
+            self.stats.count(sliceRescans=1)
+            return True
+        return random.random() * 100 < self.paranoid
+
+    def checkIndex(self, toScan, fast):
+        state = self.indexState(toScan, fast)
+        if state is None:
+            return None
+        if state[0] == 'denied':
             self.report.addDenied(toScan)
-            return
-        fileHash = hashlib.md5()
-        fileHash.update(fileBytes)
-        fileHash = fileHash.hexdigest()
-        if fast and strToScan in self.fileIndex:
-            fileInfo = self.fileIndex[strToScan]
-            if fileInfo[1] == fileHash:
-                if fileInfo[0]:
-                    if len(fileInfo) == 4:
-                        args = toScan, fileInfo[2], fileInfo[3]
-                        self.report.addFixable(*args)
-                    else:
-                        self.report.addUnfixable(toScan, fileInfo[2])
-                return
-        cbs = None if self.callbacks is None else self.callbacks[1]
+            return None
+        if state[0] == 'indexed':
+            self.reportIndexed(toScan, state[1])
+            return None
+        if (reason := self.skipReason(toScan, state[1][0])) is not None:
+            self.report.addSkipped(reason)
+            return None
+        return state[1:]
+
+    def skipReason(self, toScan, fileSize):
+        head = []
+
+        def readHead():
+            if not head:
+                with toScan.open('rb') as fileObj:
+                    head.append(fileObj.read(1024))
+            return head[0]
+        try:
+            reason = self._signatures.skipReason(fileSize, readHead)
+            if reason in ('size', 'type') and self.archiveDepth > 0 \
+                    and archives.containerType(readHead()) is not None:
+                return None
+            return reason
+        except OSError:
+            return None
+
+    def storeResult(self, toScan, statKey, fileInfo, readResult,
+                    archive=None):
+        digests, bodyMatch = readResult[:2]
+        fileHash = digests.get('sha256') if digests else None
+        timedOut = bodyMatch == sigBase.timeoutMatch
+        if self.verdicts is not None and fileHash is not None \
+                and bodyMatch is not False and not timedOut:
+            self.verdicts.set(fileHash, statKey[0], bodyMatch)
+        if archive is not None:
+            self.stats.count(archiveMembers=archive['scanned'])
         args = (
-            fileHash,
-            toScan.stat().st_size,
-            fileBytes.hex(),
-            cbs
+            digests,
+            statKey[0],
+            bodyMatch
         )
+        began = time.perf_counter()
         scanResult, resType = self._signatures.scanFile(*args)
+        stored = time.perf_counter()
         if scanResult is None:
-            return
-        self.fileIndex[strToScan] = scanResult
+            self.stats.add(lookup=stored - began)
+            return False
+        entry = {'stat': statKey, 'result': scanResult}
+        if digests:
+            entry['digests'] = digests
+        if archive is not None:
+            entry['archive'] = archive
+        if timedOut:
+            self.fileIndex.delete(str(toScan))
+        else:
+            self.fileIndex.set(str(toScan), entry)
+        self.stats.add(
+            lookup=stored - began,
+            store=time.perf_counter() - stored
+        )
         if resType:
             self.report.addFixable(toScan, scanResult[2], scanResult[3])
         if resType is False:
             self.report.addUnfixable(toScan, scanResult[2])
+        self.reportArchive(archive)
+        return True
+
+    def scanFile(self, toScan, fast):
+        if (indexed := self.checkIndex(toScan, fast)) is None:
+            return True
+        statKey, fileInfo = indexed
+        try:
+            algorithms = self.hashAlgorithms(statKey[0], fileInfo)
+            prehash = self.verdictCached(statKey[0])
+            args = toScan, statKey[0], algorithms, prehash
+            readResult = self.readFile(*args)
+        except FileNotFoundError:
+            return True
+        except OSError:
+            self.report.addDenied(toScan)
+            return True
+        if readResult is None:
+            return False
+        archive = self.scanArchive(toScan, readResult[2])
+        args = toScan, statKey, fileInfo, readResult, archive
+        return self.storeResult(*args)
+
+    def listDir(self, path, visited):
+        try:
+            dirStat = os.stat(path)
+            dirKey = (dirStat.st_dev, dirStat.st_ino)
+            if dirKey in visited:
+                return []
+            visited.add(dirKey)
+            with os.scandir(path) as entries:
+                return list(entries)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            self.report.addDenied(Path(path))
+        return []
 
     def findFiles(self, path):
-        files = []
         if path.is_file():
-            files.append(path)
-        elif path.is_dir():
+            yield path
+            return
+        visited = set()
+        stack = [iter(self.listDir(path, visited))]
+        while stack:
+            if (entry := next(stack[-1], None)) is None:
+                stack.pop()
+                continue
             try:
-                directory = list(path.iterdir())
-            except PermissionError:
-                self.report.addDenied(path)
-                return []
-            for entry in directory:
-                files.extend(self.findFiles(entry))
-        return files
+                if entry.is_file():
+                    yield Path(entry.path)
+                elif entry.is_dir():
+                    stack.append(iter(self.listDir(entry.path, visited)))
+            except OSError:
+                self.report.addDenied(Path(entry.path))
 
     def scan(self, toScan, fast):
-        progress = 0
-        cpth = ''
-        scanList = self.findFiles(toScan)
-        fileNum = len(scanList)
+        self.governor.applyPriority()
+        walker = FileWalker(self.findFiles(toScan), self.stats)
+        walker.start()
+        try:
+            if self.jobs > 1:
+                self.parallelScan(walker, fast)
+            elif self.readers > 0:
+                ScanPipeline(self, walker, fast).run()
+            else:
+                self.serialScan(walker, fast)
+        finally:
+            walker.stop()
+
+    def openCheckpoint(self, root):
+        if not self.checkpointInterval:
+            return
+        self.checkpoint = indexStore.Checkpoint(
+            self._checkpointPath, str(root)
+        )
+        if not (self.resume and self.checkpoint.load()):
+            self.checkpoint.clear()
+        self._checkpointed = time.monotonic()
+
+    def fileDone(self, toScan):
+        if self.checkpoint is not None:
+            self.checkpoint.add(str(toScan))
+
+    def saveCheckpoint(self, force):
+        if self.checkpoint is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._checkpointed < self.checkpointInterval:
+            return
+        self._checkpointed = now
+        with self.indexLock:
+            self.updateIndex()
+            self.checkpoint.save()
+
+    def closeCheckpoint(self, completed):
+        if self.checkpoint is None:
+            return
+        if completed:
+            self.checkpoint.clear()
+        else:
+            self.saveCheckpoint(True)
+        self.checkpoint.close()
+        self.checkpoint = None
+
+    def publish(self, counter, total, cpth):
+        if self.checkpoint is not None:
+            total = max(total, self.checkpoint.walked)
+            self.checkpoint.walked = total
+            self.saveCheckpoint(False)
+        if self.channel is None:
+            return False
+        self.channel.scanProgress((100*counter)//max(total, 1), cpth)
+        return self.channel.abort.is_set()
+
+    def serialScan(self, walker, fast):
+        counter = 0
+        for filePath in walker:
+            if self.publish(counter, walker.discovered, str(filePath)):
+                self.aborted = True
+                return
+            if self.scanFile(filePath, fast):
+                self.fileDone(filePath)
+            counter += 1
+        self.aborted = False
+
+    def parallelScan(self, walker, fast):
         counter = 0
-        for filePath in scanList:
-            if self.callbacks is not None:
-                progress = (100*counter)//fileNum
-                cpth = str(filePath)
-                if self.callbacks[0](progress, cpth):
+        cpth = ''
+        waiting = {}
+        toSubmit = iter(walker)
+        initArgs = (
+            *self._sigPaths,
+            self.chunkSize,
+            self.archiveLimits(),
+            self.verdictArgs(),
+            self.matchBudget,
+            self.governor.share(self.jobs)
+        )
+        with ProcessPoolExecutor(
+            self.jobs,
+            initializer=initWorker,
+            initargs=initArgs
+        ) as pool:
+            while True:
+                while len(waiting) < self.jobs * 4:
+                    if (filePath := next(toSubmit, None)) is None:
+                        break
+                    if (indexed := self.checkIndex(filePath, fast)) is None:
+                        self.fileDone(filePath)
+                        counter += 1
+                        continue
+                    statKey, fileInfo = indexed
+                    algorithms = self.hashAlgorithms(statKey[0], fileInfo)
+                    prehash = self.verdictCached(statKey[0])
+                    args = filePath, statKey[0], algorithms, prehash
+                    waiting[pool.submit(scanWorker, *args)] = \
+                        (filePath, *indexed)
+                if not waiting:
+                    break
+                done = wait(waiting, 0.05, FIRST_COMPLETED)[0]
+                for future in done:
+                    filePath, statKey, fileInfo = waiting.pop(future)
+                    cpth = str(filePath)
+                    counter += 1
+                    readResult, archive, workerStats = future.result()
+                    self.stats.merge(workerStats)
+                    done = readResult is None
+                    if readResult == 'denied':
+                        self.report.addDenied(filePath)
+                        done = True
+                    elif readResult is not None:
+                        args = filePath, statKey, fileInfo, readResult
+                        done = self.storeResult(*args, archive)
+                    if done:
+                        self.fileDone(filePath)
+                if self.publish(counter, walker.discovered, cpth):
                     self.aborted = True
+                    pool.shutdown(cancel_futures=True)
                     return
-            self.scanFile(filePath, fast)
-            counter += 1
         self.aborted = False
 
     def cutOut(self, fixableInfo):
         path = fixableInfo[0]
-        try:
-            fileHex = path.read_bytes().hex()
-        except (PermissionError, FileNotFoundError):
-            return False
         start, end = fixableInfo[2]
-        fixed = bytes.fromhex(fileHex[:start] + fileHex[end:])
         try:
-            path.write_bytes(fixed)
-        except PermissionError:
+            with path.open('r+b') as fileObj:
+                fileObj.seek(end)
+                while (chunk := fileObj.read(self.chunkSize)):
+                    end += len(chunk)
+                    fileObj.seek(start)
+                    fileObj.write(chunk)
+                    start += len(chunk)
+                    fileObj.seek(end)
+                fileObj.truncate(start)
+        except (PermissionError, FileNotFoundError):
             return False
         return True
 
-    def simpleScan(self, toScan, fast):
+    def scanChanged(self, changed):
         self.report.clear()
-        self.scan(toScan.resolve(), fast)
+        self.stats.clear()
+        self.governor.applyPriority()
+        began = time.perf_counter()
+        counter = 0
+        for path in map(Path, changed):
+            if self.publish(counter, len(changed), str(path)):
+                self.aborted = True
+                break
+            if path.is_file():
+                self.scanFile(path, True)
+            counter += 1
+        else:
+            self.aborted = False
         self.updateIndex()
+        self.stats.elapsed = time.perf_counter() - began
+        if self.channel is not None:
+            self.channel.finish()
+
+    def simpleScan(self, toScan, fast):
+        self.report.clear()
+        self.stats.clear()
+        began = time.perf_counter()
+        toScan = toScan.resolve()
+        self.openCheckpoint(toScan)
+        completed = False
+        try:
+            self.scan(toScan, fast)
+            completed = not self.aborted
+        finally:
+            self.updateIndex()
+            self.closeCheckpoint(completed)
+        self.stats.elapsed = time.perf_counter() - began
+        if self.channel is not None:
+            self.channel.finish()
 
     def getReport(self):
         return self.report.report()
 
 
+class ScanPipeline():
+    def __init__(self, scanner, walker, fast):
+        self._scanner = scanner
+        self._walker = walker
+        self._files = iter(walker)
+        self._filesLock = threading.Lock()
+        self._fast = fast
+        self._jobIds = itertools.count()
+        self._events = queue.Queue(scanner.readers * 4)
+        self._results = queue.Queue(256)
+        self._stop = threading.Event()
+
+    def nextFile(self):
+        with self._filesLock:
+            return next(self._files, None)
+
+    def read(self):
+        scanner = self._scanner
+        while not self._stop.is_set():
+            if (toScan := self.nextFile()) is None:
+                break
+            with scanner.indexLock:
+                state = scanner.indexState(toScan, self._fast)
+            if state is not None and state[0] == 'scan':
+                if (reason := scanner.skipReason(toScan, state[1][0])):
+                    state = ('skipped', reason)
+            if state is None or state[0] != 'scan':
+                self._events.put(('state', toScan, state))
+                continue
+            digests = None
+            if scanner.verdictCached(state[1][0]):
+                algorithms = scanner.hashAlgorithms(state[1][0], state[2])
+                cached = scanner.cachedRead(toScan, state[1][0], algorithms)
+                if cached is not None and cached[1] is not None:
+                    readResult = cached[0], cached[1][0], cached[2]
+                    value = (*state[1:], readResult)
+                    self._events.put(('cached', toScan, value))
+                    continue
+                if cached is not None:
+                    digests = cached[0]
+            jobId = next(self._jobIds)
+            value = (toScan, *state[1:], digests)
+            self._events.put(('start', jobId, value))
+            try:
+                with toScan.open('rb') as fileObj:
+                    scanner.governor.opened(fileObj)
+                    while not self._stop.is_set():
+                        began = time.perf_counter()
+                        chunk = fileObj.read(scanner.chunkSize)
+                        scanner.stats.add(read=time.perf_counter() - began)
+                        if not chunk:
+                            break
+                        if digests is None:
+                            scanner.governor.throttle(len(chunk))
+                        self._events.put(('chunk', jobId, chunk))
+                    scanner.governor.closing(fileObj)
+                error = 'aborted' if self._stop.is_set() else None
+            except FileNotFoundError:
+                error = 'missing'
+            except OSError:
+                error = 'denied'
+            self._events.put(('end', jobId, error))
+        self._events.put(('exit', None, None))
+
+    def write(self):
+        scanner = self._scanner
+        while (item := self._results.get()) is not None:
+            kind, toScan, value = item
+            archive = None
+            if kind == 'result':
+                archive = scanner.scanArchive(toScan, value[2][2])
+            with scanner.indexLock:
+                done = True
+                if kind == 'denied':
+                    scanner.report.addDenied(toScan)
+                elif kind == 'skipped':
+                    scanner.report.addSkipped(value)
+                elif kind == 'indexed':
+                    scanner.reportIndexed(toScan, value)
+                else:
+                    done = scanner.storeResult(toScan, *value, archive)
+                if done:
+                    scanner.fileDone(toScan)
+
+    def match(self, kind, jobId, value, jobs):
+        scanner = self._scanner
+        if kind == 'start':
+            toScan, statKey, fileInfo, digests = value
+            algorithms = scanner.hashAlgorithms(statKey[0], fileInfo)
+            fileHash = None
+            if digests is None and algorithms:
+                fileHash = sigBase.MultiHash(algorithms)
+            jobs[jobId] = [
+                value[:3],
+                scanner.openStream(statKey[0]),
+                fileHash,
+                0,
+                digests
+            ]
+            return
+        job = jobs[jobId]
+        info, stream, fileHash, done, digests = job
+        if kind == 'chunk':
+            began = time.perf_counter()
+            if fileHash is not None:
+                fileHash.update(value)
+            hashed = time.perf_counter()
+            stream.feed(value)
+            scanner.stats.add(
+                hash=hashed - began,
+                match=time.perf_counter() - hashed
+            )
+            job[3] = done + len(value)
+            if scanner.channel is not None:
+                progress = (job[3]*100)//max(info[1][0], job[3])
+                scanner.channel.fileProgress(progress)
+            return
+        del jobs[jobId]
+        if value == 'denied':
+            self._results.put(('denied', info[0], None))
+        elif value is None:
+            if fileHash is not None:
+                digests = fileHash.hexdigests()
+            began = time.perf_counter()
+            head = containerHead(stream.head, info[1][0])
+            readResult = digests, stream.finish(), head
+            scanner.stats.add(match=time.perf_counter() - began)
+            scanner.stats.count(filesRead=1, bytesRead=done)
+            self._results.put(('result', info[0], (*info[1:], readResult)))
+
+    def run(self):
+        scanner = self._scanner
+        readers = [
+            threading.Thread(target=self.read, daemon=True)
+            for _ in range(scanner.readers)
+        ]
+        writer = threading.Thread(target=self.write, daemon=True)
+        for thread in readers + [writer]:
+            thread.start()
+        jobs = {}
+        exited = 0
+        counter = 0
+        while exited < len(readers):
+            kind, key, value = self._events.get()
+            if kind == 'exit':
+                exited += 1
+                continue
+            if self._stop.is_set() or kind == 'chunk':
+                if not self._stop.is_set():
+                    self.match(kind, key, value, jobs)
+                continue
+            if kind == 'state':
+                cpth = str(key)
+                if value is not None:
+                    self._results.put((value[0], key, value[-1]))
+            elif kind == 'cached':
+                cpth = str(key)
+                self._results.put(('result', key, value))
+            else:
+                cpth = str(value[0]) if kind == 'start' else \
+                    str(jobs[key][0][0])
+                self.match(kind, key, value, jobs)
+            if kind != 'start':
+                counter += 1
+            if scanner.publish(counter, self._walker.discovered, cpth):
+                self._stop.set()
+        self._results.put(None)
+        writer.join()
+        scanner.aborted = self._stop.is_set()
+
+
+class FileWalker(threading.Thread):
+    def __init__(self, files, stats=None, queueSize=4096):
+        threading.Thread.__init__(self, daemon=True)
+        self._files = files
+        self._stats = stats
+        self._queue = queue.Queue(queueSize)
+        self._stopped = False
+        self.discovered = 0
+
+    def run(self):
+        files = iter(self._files)
+        while True:
+            began = time.perf_counter()
+            path = next(files, None)
+            if self._stats is not None:
+                self._stats.add(walk=time.perf_counter() - began)
+            if path is None or self._stopped:
+                break
+            self.discovered += 1
+            self._queue.put(path)
+        self._queue.put(None)
+
+    def __iter__(self):
+        while (path := self._queue.get()) is not None:
+            yield path
+
+    def stop(self):
+        self._stopped = True
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self.join()
+
+
 class ScanReport():
     def __init__(self):
         self._denied = []
         self._fixable = []
         self._unfixable = []
+        self._skipped = {}
 
     def addDenied(self, path):
         self._denied.append(path)
 
+    def addSkipped(self, reason, count=1):
+        self._skipped[reason] = self._skipped.get(reason, 0) + count
+
     def addFixable(self, path, malware, span):
         self._fixable.append((path, malware, span))
 
@@ -140,10 +1013,12 @@ class ScanReport():
         return (
             self._fixable.copy(),
             self._unfixable.copy(),
-            self._denied.copy()
+            self._denied.copy(),
+            self._skipped.copy()
         )
 
     def clear(self):
         self._denied = []
         self._fixable = []
         self._unfixable = []
+        self._skipped = {}
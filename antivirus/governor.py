@@ -0,0 +1,123 @@
+import ctypes
+import mmap
+import os
+import platform
+import threading
+import time
+
+ioClasses = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+ioprioSyscalls = {
+    'x86_64': 251,
+    'i386': 289,
+    'i686': 289,
+    'aarch64': 30,
+    'riscv64': 30,
+    'armv7l': 314
+}
+
+
+def setNice(nice):
+    try:
+        threadId = threading.get_native_id()
+        if os.getpriority(os.PRIO_PROCESS, threadId) < nice:
+            os.setpriority(os.PRIO_PROCESS, threadId, nice)
+    except (OSError, AttributeError):
+        return False
+    return True
+
+
+def setIoClass(ioClass, level=4):
+    number = ioprioSyscalls.get(platform.machine())
+    if number is None:
+        return False
+    if ioClass == 'idle':
+        level = 0
+    value = ioClasses[ioClass] << 13 | level
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.syscall(number, 1, 0, value) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def advise(fileObj, advice):
+    try:
+        os.posix_fadvise(fileObj.fileno(), 0, 0, advice)
+    except (OSError, AttributeError, ValueError):
+        pass
+
+
+class Governor():
+    burst = 0.5
+
+    def __init__(self, readLimit=0, nice=None, ioClass=None,
+                 dropCache=False):
+        self.readLimit = readLimit
+        self.nice = nice
+        self.ioClass = ioClass
+        self.dropCache = dropCache
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def share(self, parts):
+        return Governor(
+            self.readLimit / max(parts, 1),
+            self.nice,
+            self.ioClass,
+            self.dropCache
+        )
+
+    def applyPriority(self):
+        if self.nice is not None:
+            setNice(self.nice)
+        if self.ioClass is not None:
+            setIoClass(self.ioClass)
+
+    def throttle(self, amount):
+        if not self.readLimit:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now - self.burst)
+            self._next += amount / (self.readLimit * (1 << 20))
+            delay = self._next - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def opened(self, fileObj):
+        if self.dropCache:
+            advise(fileObj, os.POSIX_FADV_SEQUENTIAL)
+
+    def mapped(self, mapped):
+        if self.dropCache and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+    def closing(self, fileObj):
+        if self.dropCache:
+            advise(fileObj, os.POSIX_FADV_DONTNEED)
+
+    def forget(self, path):
+        if not self.dropCache:
+            return
+        try:
+            with open(path, 'rb') as fileObj:
+                advise(fileObj, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+    def describe(self):
+        limit = f'{self.readLimit:g} MB/s' if self.readLimit else 'none'
+        priority = 'low' if self.nice or self.ioClass == 'idle' \
+            else 'normal'
+        cache = 'dropped' if self.dropCache else 'kept'
+        return f'read limit: {limit}, priority: {priority}, ' \
+            f'page cache: {cache}'
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
@@ -0,0 +1,367 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+def prefixBounds(prefix):
+    if not prefix:
+        return '', None
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class JsonIndex():
+    def __init__(self, path):
+        self._path = Path(path)
+        try:
+            with open(self._path) as jsonIndex:
+                self._entries = json.load(jsonIndex)
+        except FileNotFoundError:
+            self._entries = {}
+
+    def get(self, path):
+        return self._entries.get(path)
+
+    def set(self, path, entry):
+        self._entries[path] = entry
+
+    def delete(self, path):
+        self._entries.pop(path, None)
+
+    def paths(self, prefix=''):
+        low, high = prefixBounds(prefix)
+        return [
+            path for path in self._entries
+            if path >= low and (high is None or path < high)
+        ]
+
+    def items(self):
+        return list(self._entries.items())
+
+    def flush(self):
+        tempPath = self._path.with_name(self._path.name + '.tmp')
+        with open(tempPath, 'w') as jsonIndex:
+            json.dump(self._entries, jsonIndex, indent=4)
+        os.replace(tempPath, self._path)
+
+    def close(self):
+        self.flush()
+
+
+class SqliteIndex():
+    batchSize = 1000
+
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS files '
+            '(path TEXT PRIMARY KEY, entry TEXT NOT NULL)'
+        )
+        self._connection.commit()
+        self._pending = {}
+
+    def get(self, path):
+        if path in self._pending:
+            return self._pending[path]
+        row = self._connection.execute(
+            'SELECT entry FROM files WHERE path = ?', (path,)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set(self, path, entry):
+        self._pending[path] = entry
+        if len(self._pending) >= self.batchSize:
+            self.flush()
+
+    def delete(self, path):
+        self.set(path, None)
+
+    def paths(self, prefix=''):
+        self.flush()
+        low, high = prefixBounds(prefix)
+        if high is None:
+            query = 'SELECT path FROM files WHERE path >= ?', (low,)
+        else:
+            query = (
+                'SELECT path FROM files WHERE path >= ? AND path < ?',
+                (low, high)
+            )
+        return [row[0] for row in self._connection.execute(*query)]
+
+    def items(self):
+        self.flush()
+        rows = self._connection.execute('SELECT path, entry FROM files')
+        return [(path, json.loads(entry)) for path, entry in rows]
+
+    def flush(self):
+        if not self._pending:
+            return
+        upserts = []
+        deletes = []
+        for path, entry in self._pending.items():
+            if entry is None:
+                deletes.append((path,))
+            else:
+                upserts.append((path, json.dumps(entry)))
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO files VALUES (?, ?)', upserts
+            )
+            self._connection.executemany(
+                'DELETE FROM files WHERE path = ?', deletes
+            )
+        self._pending = {}
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+
+class SharedIndex():
+    def __init__(self, index):
+        self._index = index
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        with self._lock:
+            return self._index.get(path)
+
+    def set(self, path, entry):
+        with self._lock:
+            self._index.set(path, entry)
+
+    def delete(self, path):
+        with self._lock:
+            self._index.delete(path)
+
+    def paths(self, prefix=''):
+        with self._lock:
+            return self._index.paths(prefix)
+
+    def items(self):
+        with self._lock:
+            return self._index.items()
+
+    def flush(self):
+        with self._lock:
+            self._index.flush()
+
+    def close(self):
+        with self._lock:
+            self._index.close()
+
+
+class VerdictCache():
+    batchSize = 1000
+
+    def __init__(self, path, version, capacity):
+        self.version = version
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS verdicts (digest TEXT PRIMARY KEY, '
+            'version TEXT NOT NULL, verdict TEXT NOT NULL, used REAL NOT NULL)'
+        )
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS verdictsUsed ON verdicts (used)'
+        )
+        self._connection.commit()
+        self._pending = {}
+        self._touched = {}
+        self._sizes = {
+            int(row[0]) for row in self._connection.execute(
+                "SELECT DISTINCT substr(digest, 1, instr(digest, ':') - 1) "
+                'FROM verdicts WHERE version = ?', (version,)
+            )
+        }
+
+    @staticmethod
+    def key(digest, fileSize):
+        return f'{fileSize}:{digest}'
+
+    def hasSize(self, fileSize):
+        with self._lock:
+            return fileSize in self._sizes
+
+    def purgeStale(self):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'DELETE FROM verdicts WHERE version != ?', (self.version,)
+            )
+
+    def get(self, digest, fileSize):
+        key = self.key(digest, fileSize)
+        with self._lock:
+            if key in self._pending:
+                return (self._pending[key],)
+            row = self._connection.execute(
+                'SELECT verdict FROM verdicts '
+                'WHERE digest = ? AND version = ?',
+                (key, self.version)
+            ).fetchone()
+            if row is None:
+                return None
+            self._touched[key] = time.time()
+        verdict = json.loads(row[0])
+        if verdict is None:
+            return (None,)
+        return ((tuple(verdict[0]), verdict[1]),)
+
+    def set(self, digest, fileSize, bodyMatch):
+        with self._lock:
+            self._pending[self.key(digest, fileSize)] = bodyMatch
+            self._sizes.add(fileSize)
+            if len(self._pending) >= self.batchSize:
+                self.write()
+
+    def flush(self):
+        with self._lock:
+            self.write()
+
+    def write(self):
+        if not self._pending and not self._touched:
+            return
+        now = time.time()
+        rows = [
+            (key, self.version, json.dumps(verdict), now)
+            for key, verdict in self._pending.items()
+        ]
+        touched = [(used, key) for key, used in self._touched.items()]
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?)', rows
+            )
+            self._connection.executemany(
+                'UPDATE verdicts SET used = ? WHERE digest = ?', touched
+            )
+            count = self._connection.execute(
+                'SELECT COUNT(*) FROM verdicts'
+            ).fetchone()[0]
+            if count > self.capacity:
+                self._connection.execute(
+                    'DELETE FROM verdicts WHERE digest IN '
+                    '(SELECT digest FROM verdicts ORDER BY used LIMIT ?)',
+                    (count - self.capacity,)
+                )
+        self._pending = {}
+        self._touched = {}
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+
+class Checkpoint():
+    def __init__(self, path, root):
+        self.root = root
+        self.walked = 0
+        self.resuming = False
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS checkpoints '
+            '(root TEXT PRIMARY KEY, walked INTEGER NOT NULL)'
+        )
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS checkpointFiles (root TEXT NOT NULL, '
+            'path TEXT NOT NULL, PRIMARY KEY (root, path))'
+        )
+        self._connection.commit()
+        self._pending = []
+
+    def load(self):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT walked FROM checkpoints WHERE root = ?', (self.root,)
+            ).fetchone()
+        self.resuming = row is not None
+        if self.resuming:
+            self.walked = row[0]
+        return self.resuming
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'DELETE FROM checkpoints WHERE root = ?', (self.root,)
+            )
+            self._connection.execute(
+                'DELETE FROM checkpointFiles WHERE root = ?', (self.root,)
+            )
+        self._pending = []
+        self.resuming = False
+        self.walked = 0
+
+    def isDone(self, path):
+        if not self.resuming:
+            return False
+        with self._lock:
+            return self._connection.execute(
+                'SELECT 1 FROM checkpointFiles WHERE root = ? AND path = ?',
+                (self.root, path)
+            ).fetchone() is not None
+
+    def add(self, path):
+        with self._lock:
+            self._pending.append((self.root, path))
+
+    def save(self):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO checkpointFiles VALUES (?, ?)',
+                self._pending
+            )
+            self._connection.execute(
+                'INSERT OR REPLACE INTO checkpoints VALUES (?, ?)',
+                (self.root, self.walked)
+            )
+            self._pending = []
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def verdictPath(indexPath):
+    indexPath = Path(indexPath)
+    if indexPath.suffix == '.json':
+        return indexPath.with_suffix('.verdicts.db')
+    return indexPath
+
+
+def checkpointPath(indexPath):
+    indexPath = Path(indexPath)
+    if indexPath.suffix == '.json':
+        return indexPath.with_suffix('.checkpoint.db')
+    return indexPath
+
+
+def migrateJson(jsonPath, index):
+    old = JsonIndex(jsonPath)
+    for path, entry in old.items():
+        if isinstance(entry, list) and len(entry) >= 2:
+            digests = {'md5': entry[1]} if entry[1] else {}
+            entry = {'stat': None, 'result': entry, 'digests': digests}
+        if isinstance(entry, dict):
+            index.set(path, entry)
+    index.flush()
+    os.replace(jsonPath, str(jsonPath) + '.migrated')
+
+
+def openIndex(path):
+    path = Path(path)
+    if path.suffix == '.json':
+        return JsonIndex(path)
+    index = SqliteIndex(path)
+    legacyPath = path.with_name('index.json')
+    if legacyPath.exists():
+        migrateJson(legacyPath, index)
+    return index
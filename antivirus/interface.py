@@ -1,3 +1,4 @@
+import progress
 import curses
 import time
 from pathlib import Path
@@ -7,32 +8,19 @@ ENTER_KEY = 10
 
 class Interface():
     def __init__(self, stdscr):
-        self.quit = False
         self.stdscr = stdscr
-        self.progress = 0
-        self.filProgress = 0
-        self.cpth = ''
+        self.channel = progress.ProgressChannel()
         curses.init_pair(1, curses.COLOR_RED, curses.COLOR_BLACK)
         curses.init_pair(2, curses.COLOR_GREEN, curses.COLOR_BLACK)
         curses.curs_set(0)
 
-    def setProgress(self, val, cpth):
-        self.progress = val
-        self.cpth = cpth
-        return self.quit
-
-    def setFilProgress(self, val):
-        self.filProgress = val
-        return self.quit
-
-    def setQuit(self, val):
-        self.quit = val
-
-    def getProg(self):
-        return (self.progress, self.filProgress, self.cpth)
-
     def getScanType(self):
-        choices = ['standard scan', 'periodic scan']
+        choices = [
+            'standard scan',
+            'periodic scan',
+            'watch for changes',
+            'rolling periodic scan'
+        ]
         with SimpleChoice(self.stdscr, choices, 'Choose:') as win:
             action = win.get()
         return action
@@ -54,18 +42,20 @@ class Interface():
         return action
 
     def scanWindow(self, scanTh):
-        with ScanWin(scanTh, self.stdscr, self.setQuit, self.getProg) as win:
+        with ScanWin(scanTh, self.stdscr, self.channel) as win:
             win.get()
-        self.progress = 0
-        self.filProgress = 0
-        self.cpth = ''
 
     def displayReport(self, scanner):
         with ReportWin(self.stdscr, scanner) as win:
             win.get()
 
-    def periodicScanMenu(self, path, period, lastOk):
-        with PeriodicMenu(self.stdscr, path, period, lastOk) as win:
+    def periodicScanMenu(self, path, period, lastOk, governor, rolling=None):
+        args = self.stdscr, path, period, lastOk, governor, rolling
+        with PeriodicMenu(*args) as win:
+            return win.get()
+
+    def watchMenu(self, path, watch, lastOk):
+        with WatchMenu(self.stdscr, path, watch, lastOk) as win:
             return win.get()
 
 
@@ -587,25 +577,54 @@ class ReportText():
 
 
 class PeriodicMenu(Window):
+    readLimits = [0, 10, 50, 200]
+
     def scan(self):
         if self.remaining < 1:
             return 'scan'
         return None
 
-    def __init__(self, stdscr, pth, period, last):
+    def cycleLimit(self):
+        limits = self.readLimits
+        if self.governor.readLimit in limits:
+            index = limits.index(self.governor.readLimit) + 1
+        else:
+            index = 0
+        self.governor.readLimit = limits[index % len(limits)]
+
+    def togglePriority(self):
+        if self.governor.nice or self.governor.ioClass == 'idle':
+            self.governor.nice = None
+            self.governor.ioClass = None
+        else:
+            self.governor.nice = 19
+            self.governor.ioClass = 'idle'
+
+    def toggleCache(self):
+        self.governor.dropCache = not self.governor.dropCache
+
+    def __init__(self, stdscr, pth, period, last, governor, rolling=None):
         self.path = str(pth)
         self.stdscr = stdscr
+        self.governor = governor
         self.scanTime = period + time.time()
         self.remaining = int(self.scanTime-time.time())
+        if rolling is not None:
+            shard, shards = rolling
+            self.path += f' (slice {shard + 1} of {shards})'
         self.pathText = Text(stdscr, 0, 0, f'To scan: {self.path}')
         self.timeText = Text(stdscr, 1, 1, '')
+        self.governorText = Text(stdscr, 1, 2, '')
         options = {
             BACK_KEY: lambda: 'back',
+            ord('l'): self.cycleLimit,
+            ord('p'): self.togglePriority,
+            ord('c'): self.toggleCache,
             -1: self.scan
         }
-        legend = 'ESC: back'
+        legend = 'ESC: back, L: read limit, P: priority, C: page cache'
         super().__init__(stdscr, options, legend)
-        self.items = [self.pathText, self.timeText]
+        self.items = [self.pathText, self.timeText, self.governorText]
         if last:
             self.setStatus('Last scan: Ok', curses.color_pair(2))
         elif last is None:
@@ -615,6 +634,7 @@ class PeriodicMenu(Window):
         while True:
             self.remaining = int(self.scanTime-time.time())
             self.timeText.text = f'Time to next scan: {self.remaining}s'
+            self.governorText.text = self.governor.describe()
             self.draw()
             choice = self.getAction()
             if choice is not None:
@@ -629,14 +649,53 @@ class PeriodicMenu(Window):
         return False
 
 
+class WatchMenu(Window):
+    def __init__(self, stdscr, pth, watch, last):
+        self.watch = watch
+        self.stdscr = stdscr
+        self.pathText = Text(stdscr, 0, 0, f'Watching: {pth}')
+        self.infoText = Text(stdscr, 1, 1, 'Waiting for changes...')
+        options = {
+            BACK_KEY: lambda: 'back'
+        }
+        legend = 'ESC: back'
+        super().__init__(stdscr, options, legend)
+        self.items = [self.pathText, self.infoText]
+        if watch.failed:
+            msg = f'{len(watch.failed)} directories could not be watched'
+            self.setStatus(msg, curses.color_pair(1))
+        elif last:
+            self.setStatus('Last scan: Ok', curses.color_pair(2))
+        elif last is None:
+            self.setStatus('scan aborted', curses.color_pair(1))
+
+    def get(self):
+        while True:
+            self.draw()
+            choice = self.getAction()
+            if choice is not None:
+                return choice
+            if self.watch.takeOverflow():
+                return 'rescan'
+            if (changed := self.watch.ready()):
+                return changed
+
+    def __enter__(self):
+        self.stdscr.timeout(100)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stdscr.timeout(-1)
+        return False
+
+
 class ScanWin(Window):
     def back(self):
         self.setStatus('aborting scan...')
-        self.quit(True)
+        self.channel.abort.set()
 
-    def __init__(self, scanTh, stdscr, setQuit, getProg):
-        self.quit = setQuit
-        self.progress = getProg
+    def __init__(self, scanTh, stdscr, channel):
+        self.channel = channel
         self.scanTh = scanTh
         self.scanText = Text(stdscr, 0, 0, '')
         self.progText = Text(stdscr, 0, 1, '')
@@ -645,20 +704,17 @@ class ScanWin(Window):
         self.items = [self.scanText, self.progText]
 
     def get(self):
-        while True:
-            prog, filProg, cpth = self.progress()
+        while self.scanTh.is_alive():
+            prog, filProg, cpth = self.channel.wait(0.05)
             if cpth:
                 self.scanText.text = f'scanning: {cpth} ({filProg}%)'
             else:
                 self.scanText.text = 'processing...'
             self.progText.text = f'progress: {prog}%'
             self.draw()
-            self.scanTh.join(0.05)
-            if self.scanTh.isAlive():
-                if self.stdscr.getch() == BACK_KEY:
-                    self.back()
-            else:
-                break
+            if self.stdscr.getch() == BACK_KEY:
+                self.back()
+        self.scanTh.join()
 
     def __enter__(self):
         self.stdscr.timeout(0)
@@ -666,7 +722,7 @@ class ScanWin(Window):
 
     def __exit__(self, type, value, traceback):
         self.stdscr.timeout(-1)
-        self.quit(False)
+        self.channel.reset()
         return False
 
 
@@ -684,6 +740,7 @@ class ReportWin(Window):
             reportLines.append('Access was denied to the following:')
             for info in report[2]:
                 reportLines.append(str(info))
+        reportLines.extend(skippedLines(report[3]))
         return reportLines
 
     def save(self):
@@ -712,21 +769,28 @@ class ReportWin(Window):
             self.setStatus('No fixes possible')
         self.text.maxBegin = len(self.text.report) - 1
 
+    def toggleStats(self):
+        self.text.report, self.hidden = self.hidden, self.text.report
+        self.text.drawBegin = 0
+        return None
+
     def __init__(self, stdscr, scanner):
         self.scanner = scanner
         self.triedFix = False
         rep = scanner.getReport()
         self.fixable = rep[0]
         report = self.fromReport(rep)
+        self.hidden = statsLines(scanner.stats, scanner.signatureName)
         self.text = ReportText(0, 0, report, stdscr)
         actions = {
             curses.KEY_UP: self.text.up,
             curses.KEY_DOWN: self.text.down,
             BACK_KEY: lambda: 'back',
             ord('s'): self.save,
-            ord('f'): self.fix
+            ord('f'): self.fix,
+            ord('t'): self.toggleStats
         }
-        legend = 'ESC: back, S: save report, F: fix files'
+        legend = 'ESC: back, S: save report, F: fix files, T: statistics'
         super().__init__(stdscr, actions, legend)
         self.items = [self.text]
         if scanner.aborted:
@@ -746,7 +810,25 @@ class ReportWin(Window):
         return False
 
 
-def printCmdResult(report, fixed, denied):
+skipReasons = {
+    'empty': 'empty files',
+    'size': 'files smaller than every signature',
+    'type': 'files of a type no signature targets',
+    'archiveLimit': 'archives cut short by the depth, member or size limits',
+    'archiveError': 'unreadable archive members'
+}
+
+
+def skippedLines(skipped):
+    if not skipped:
+        return []
+    lines = ['Skipped:']
+    for reason, count in sorted(skipped.items()):
+        lines.append(f'  {count} {skipReasons.get(reason, reason)}')
+    return lines
+
+
+def printCmdResult(report, fixed, denied, skipped=False):
     infected = [f'{info[0]} -> {info[1]}' for info in report[0] + report[1]]
     if infected:
         print('\n'.join(infected))
@@ -754,6 +836,32 @@ def printCmdResult(report, fixed, denied):
         if report[2]:
             print('denied access to:')
             print('\n'.join([str(pth) for pth in report[2]]))
+    if skipped and (lines := skippedLines(report[3])):
+        print('\n'.join(lines))
     if fixed:
         print('fixed:')
         print('\n'.join(fixed))
+
+
+def statsLines(stats, signatureName, slowest=10):
+    cache = 'cache' if stats.sigCache else 'source files'
+    lines = [
+        f'scan time: {stats.elapsed:.3f}s',
+        f'signatures loaded from {cache} in {stats.sigLoad:.3f}s',
+        'time per stage:'
+    ]
+    for stage, seconds in stats.stages.items():
+        lines.append(f'  {stage:<8} {seconds:10.3f}s')
+    lines.append('counters:')
+    for counter, amount in sorted(stats.counters.items()):
+        lines.append(f'  {counter:<14} {amount}')
+    if (ranked := stats.slowest(slowest)):
+        lines.append('slowest signatures:')
+        for sigIndex, seconds, checks in ranked:
+            name = signatureName(sigIndex)
+            lines.append(f'  {seconds:10.6f}s {checks:8} checks  {name}')
+    return lines
+
+
+def printCmdStats(stats, signatureName):
+    print('\n'.join(statsLines(stats, signatureName)))
@@ -0,0 +1,49 @@
+import queue
+import threading
+import time
+
+
+class ProgressChannel():
+    def __init__(self, interval=0.05):
+        self.abort = threading.Event()
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._state = [0, 0, '']
+        self._updates = queue.Queue(1)
+        self._published = 0.0
+
+    def scanProgress(self, progress, path):
+        with self._lock:
+            self._state = [progress, 0, path]
+        self.notify(False)
+
+    def fileProgress(self, progress):
+        with self._lock:
+            self._state[1] = progress
+        self.notify(False)
+
+    def notify(self, force):
+        now = time.monotonic()
+        if not force and now - self._published < self.interval:
+            return
+        self._published = now
+        try:
+            self._updates.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def finish(self):
+        self.notify(True)
+
+    def wait(self, timeout):
+        try:
+            self._updates.get(timeout=timeout)
+        except queue.Empty:
+            pass
+        with self._lock:
+            return tuple(self._state)
+
+    def reset(self):
+        with self._lock:
+            self._state = [0, 0, '']
+        self.abort.clear()
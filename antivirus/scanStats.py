@@ -0,0 +1,58 @@
+import threading
+
+stageNames = ('walk', 'index', 'read', 'hash', 'match', 'lookup', 'store')
+
+
+class ScanStats():
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sigLoad = 0.0
+        self.sigCache = False
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.elapsed = 0.0
+            self.stages = dict.fromkeys(stageNames, 0.0)
+            self.counters = {}
+            self.sigTimes = {}
+
+    def add(self, **stages):
+        with self._lock:
+            for stage, seconds in stages.items():
+                self.stages[stage] += seconds
+
+    def count(self, **counters):
+        with self._lock:
+            for counter, amount in counters.items():
+                self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def addSigTimes(self, sigTimes):
+        with self._lock:
+            for sigIndex, (seconds, checks) in sigTimes.items():
+                total = self.sigTimes.setdefault(sigIndex, [0.0, 0])
+                total[0] += seconds
+                total[1] += checks
+
+    def merge(self, other):
+        self.add(**other.stages)
+        self.count(**other.counters)
+        self.addSigTimes(other.sigTimes)
+
+    def slowest(self, count):
+        with self._lock:
+            ranked = sorted(
+                self.sigTimes.items(),
+                key=lambda item: item[1][0],
+                reverse=True
+            )
+        return [(sigIndex, *total) for sigIndex, total in ranked[:count]]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
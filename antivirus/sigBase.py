@@ -1,82 +1,789 @@
+import os
+import pickle
+import hashlib
 import re
+import struct
+import sys
+import time
+from pathlib import Path
+import ahoCorasick
 
 
 class BodySignature():
+    tokenPattern = re.compile(
+        r'([0-9a-fA-F]{2})|(\?\?)|([0-9a-fA-F])\?|\?([0-9a-fA-F])|(\*)'
+        r'|\{(\d*)(-?)(\d*)\}|\(([0-9a-fA-F|]+)\)'
+    )
+
     @staticmethod
-    def prepStr(sigStr):
-        return sigStr.replace('*', '(..)*').replace('?', '.')\
-            .replace('-', ',').replace('{', '(..){')
+    def byteClass(values):
+        return ('class', (frozenset(bytes([val]) for val in values), 1, 1))
 
-    def __init__(self, name, sig):
-        self._signature = re.compile(self.prepStr(sig))
-        self.malwareName = name
+    @classmethod
+    def parse(cls, sigStr):
+        tokens = []
+        position = 0
+        while position < len(sigStr):
+            token = cls.tokenPattern.match(sigStr, position)
+            if token is None:
+                raise ValueError(f'invalid body signature: {sigStr}')
+            position = token.end()
+            byte, anyByte, high, low, star, gapMin, dash, gapMax, alt = \
+                token.groups()
+            if byte:
+                value = bytes.fromhex(byte)
+                if tokens and tokens[-1][0] == 'bytes':
+                    tokens[-1] = ('bytes', tokens[-1][1] + value)
+                else:
+                    tokens.append(('bytes', value))
+                continue
+            if anyByte:
+                gap = (1, 1)
+            elif star:
+                gap = (0, None)
+            elif high:
+                start = int(high, 16) << 4
+                values = range(start, start+16)
+                tokens.append(cls.byteClass(values))
+                continue
+            elif low:
+                values = range(int(low, 16), 256, 16)
+                tokens.append(cls.byteClass(values))
+                continue
+            elif alt:
+                options = frozenset(
+                    bytes.fromhex(opt) for opt in alt.split('|')
+                )
+                lengths = [len(opt) for opt in options]
+                tokens.append(
+                    ('class', (options, min(lengths), max(lengths)))
+                )
+                continue
+            else:
+                least = int(gapMin or 0)
+                gap = (least, int(gapMax) if gapMax else None)
+                if not dash:
+                    gap = (least, least)
+            if tokens and tokens[-1][0] == 'gap':
+                prevMin, prevMax = tokens[-1][1]
+                if prevMax is None or gap[1] is None:
+                    gap = (prevMin + gap[0], None)
+                else:
+                    gap = (prevMin + gap[0], prevMax + gap[1])
+                tokens[-1] = ('gap', gap)
+            else:
+                tokens.append(('gap', gap))
+        return tokens
 
-    def match(self, hexFile):
-        return self._signature.search(hexFile)
+    @staticmethod
+    def splitParts(tokens):
+        parts = [(0, [])]
+        for kind, value in tokens:
+            if kind == 'gap' and value[1] is None:
+                if parts[-1][1]:
+                    parts.append((value[0], []))
+                else:
+                    parts[-1] = (parts[-1][0] + value[0], [])
+            else:
+                parts[-1][1].append((kind, value))
+        if not parts[-1][1]:
+            minGap = parts.pop()[0]
+            if parts and minGap:
+                parts[-1][1].append(('gap', (minGap, minGap)))
+        return parts
 
+    @staticmethod
+    def parseOffset(offset):
+        if offset == '*':
+            return None
+        base, _, shift = offset.partition(',')
+        shift = int(shift or 0)
+        if base.startswith('EOF-'):
+            return 'EOF', -int(base[4:]), shift
+        if base.startswith('EP+') or base.startswith('EP-'):
+            return 'EP', int(base[2:]), shift
+        if base.isdigit():
+            return 'BOF', int(base), shift
+        return None
 
-class HashSignature():
-    def __init__(self, name, sig, fileSize):
+    def __init__(self, name, targetType, offset, sig):
+        self.targetType = int(targetType)
+        self.offset = self.parseOffset(offset)
+        tokens = self.parse(sig)
+        self.parts = []
+        for minGap, partTokens in self.splitParts(tokens):
+            part = SigPart(minGap, partTokens)
+            if not part.anchors:
+                raise ValueError(f'body signature part without anchor: {sig}')
+            self.parts.append(part)
+        if not self.parts:
+            raise ValueError(f'empty body signature: {sig}')
+        self.maxPartLen = max(part.maxLen for part in self.parts)
+        self.minLen = sum(part.minGap + part.minLen for part in self.parts)
+        if self.offset is not None and self.offset[0] == 'BOF':
+            self.minLen += max(self.offset[1], 0)
         self.malwareName = name
-        self._signature = sig
-        self._fileSize = int(fileSize)
 
-    def getSize(self):
-        return self._fileSize
+    def startRange(self, fileSize, entry):
+        kind, delta, shift = self.offset
+        if kind == 'EOF':
+            if fileSize is None:
+                return None
+            delta += fileSize
+        elif kind == 'EP':
+            if entry is None:
+                return None
+            delta += entry
+        if delta + shift < 0:
+            return None
+        return max(delta, 0), delta + shift
+
+    def match(self, fileBytes):
+        head = fileBytes[:headSize]
+        if self.targetType not in detectTypes(head):
+            return None
+        position = 0
+        limit = None
+        if self.offset is not None:
+            startRange = self.startRange(len(fileBytes), entryPoint(head))
+            if startRange is None:
+                return None
+            position, limit = startRange
+        start = None
+        end = len(fileBytes)
+        for part in self.parts:
+            span = part.search(fileBytes, position + part.minGap, end, limit)
+            if span is None:
+                return None
+            if start is None:
+                start = span[0]
+            limit = None
+            position = span[1]
+        return start, position
+
+
+def addPoint(spans, position):
+    if spans and spans[-1][1] + 1 == position:
+        spans[-1][1] = position
+    else:
+        spans.append([position, position])
+
+
+def stepForward(window, spans, kind, value, limit):
+    reached = []
+    if kind == 'gap':
+        for low, high in spans:
+            low, high = low + value[0], min(high + value[1], limit)
+            if low > high:
+                break
+            if reached and low <= reached[-1][1] + 1:
+                reached[-1][1] = max(reached[-1][1], high)
+            else:
+                reached.append([low, high])
+        return reached
+    if kind == 'bytes':
+        size = len(value)
+        for low, high in spans:
+            end = min(high + size, limit)
+            found = window.find(value, low, end)
+            while found != -1:
+                addPoint(reached, found + size)
+                found = window.find(value, found + 1, end)
+        return reached
+    options, sizes = value
+    ends = set()
+    for low, high in spans:
+        for position in range(low, high + 1):
+            for size in sizes:
+                if position + size <= limit and \
+                        window[position:position+size] in options:
+                    ends.add(position + size)
+    for end in sorted(ends):
+        addPoint(reached, end)
+    return reached
+
+
+def stepBackward(window, spans, kind, value, limit):
+    reached = []
+    if kind == 'gap':
+        for low, high in spans:
+            low, high = max(low - value[1], limit), high - value[0]
+            if low > high:
+                continue
+            if reached and low <= reached[-1][1] + 1:
+                reached[-1][1] = max(reached[-1][1], high)
+            else:
+                reached.append([low, high])
+        return reached
+    if kind == 'bytes':
+        size = len(value)
+        for low, high in spans:
+            found = window.find(value, max(low - size, limit), high)
+            while found != -1:
+                addPoint(reached, found)
+                found = window.find(value, found + 1, high)
+        return reached
+    options, sizes = value
+    starts = set()
+    for low, high in spans:
+        for position in range(low, high + 1):
+            for size in sizes:
+                if position - size >= limit and \
+                        window[position-size:position] in options:
+                    starts.add(position - size)
+    for start in sorted(starts):
+        addPoint(reached, start)
+    return reached
+
+
+class SigPart():
+    @staticmethod
+    def tokenLen(kind, value):
+        if kind == 'bytes':
+            return len(value), len(value)
+        if kind == 'class':
+            return value[1], value[2]
+        return value
+
+    @staticmethod
+    def compileToken(kind, value):
+        if kind == 'class':
+            return kind, (value[0], sorted({len(opt) for opt in value[0]}))
+        return kind, value
+
+    @staticmethod
+    def anchorIndex(tokens):
+        best = None
+        bestKey = None
+        for index, (kind, value) in enumerate(tokens):
+            if kind == 'bytes':
+                key = (1, len(value), 0)
+            elif kind == 'class' and value[1] > 0:
+                key = (0, value[1], -len(value[0]))
+            else:
+                continue
+            if bestKey is None or key > bestKey:
+                best = index
+                bestKey = key
+        return best
+
+    def __init__(self, minGap, tokens):
+        self.minGap = minGap
+        lengths = [self.tokenLen(*token) for token in tokens]
+        anchorIndex = self.anchorIndex(tokens)
+        self.maxLen = sum(length[1] for length in lengths)
+        self.minLen = sum(length[0] for length in lengths)
+        if anchorIndex is None:
+            self.anchors = ()
+            return
+        kind, value = tokens[anchorIndex]
+        self.anchors = (value,) if kind == 'bytes' else tuple(sorted(value[0]))
+        self.anchorSizes = sorted({len(anchor) for anchor in self.anchors})
+        self.headMax = sum(length[1] for length in lengths[:anchorIndex])
+        self.before = self.headMax + lengths[anchorIndex][1]
+        self.after = self.maxLen - self.before
+        self.headMin = sum(length[0] for length in lengths[:anchorIndex])
+        self.head = [
+            self.compileToken(*token) for token in tokens[anchorIndex-1::-1]
+        ] if anchorIndex else []
+        self.tail = [
+            self.compileToken(*token) for token in tokens[anchorIndex+1:]
+        ]
+
+    def anchorsAt(self, window, anchorStart, anchorEnd):
+        if len(self.anchorSizes) == 1:
+            return anchorEnd - anchorStart == self.anchorSizes[0]
+        return window[anchorStart:anchorEnd] in self.anchors
+
+    def verifyAt(self, window, anchorStart, anchorEnd, low, high):
+        if anchorStart < low or anchorEnd > high:
+            return None
+        ends = [[anchorEnd, anchorEnd]]
+        for kind, value in self.tail:
+            if not (ends := stepForward(window, ends, kind, value, high)):
+                return None
+        starts = [[anchorStart, anchorStart]]
+        for kind, value in self.head:
+            if not (starts := stepBackward(window, starts, kind, value, low)):
+                return None
+        return starts[0][0], ends[0][0]
+
+    def verify(self, window, anchorEnd, low, high, startLimit=None):
+        best = None
+        for size in self.anchorSizes:
+            anchorStart = anchorEnd - size
+            if anchorStart < low or \
+                    not self.anchorsAt(window, anchorStart, anchorEnd):
+                continue
+            span = self.verifyAt(window, anchorStart, anchorEnd, low, high)
+            if span is None or \
+                    startLimit is not None and span[0] > startLimit:
+                continue
+            if best is None or span[1] < best[1]:
+                best = span
+        return best
+
+    def findAnchor(self, window, start, end):
+        found = -1
+        for anchor in self.anchors:
+            position = window.find(anchor, start, end)
+            if position != -1 and (found == -1 or position < found):
+                found = position
+        return found
+
+    def search(self, window, low, high, startLimit=None):
+        best = None
+        found = self.findAnchor(window, low + self.headMin, high)
+        while found != -1:
+            if startLimit is not None and found - self.headMax > startLimit:
+                break
+            if best is not None and found + self.anchorSizes[0] >= best[1]:
+                break
+            for size in self.anchorSizes:
+                if not self.anchorsAt(window, found, found + size):
+                    continue
+                span = self.verifyAt(window, found, found + size, low, high)
+                if span is None or \
+                        startLimit is not None and span[0] > startLimit:
+                    continue
+                if best is None or span[1] < best[1]:
+                    best = span
+            found = self.findAnchor(window, found + 1, high)
+        return best
+
+
+magicPrefixes = (
+    (1, (b'MZ',)),
+    (2, (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1',)),
+    (4, (b'From ', b'Received:', b'Return-Path:')),
+    (5, (b'\x89PNG', b'GIF8', b'\xff\xd8\xff', b'BM', b'II*\x00', b'MM\x00*')),
+    (6, (b'\x7fELF',)),
+    (9, (
+        b'\xfe\xed\xfa\xce', b'\xfe\xed\xfa\xcf',
+        b'\xce\xfa\xed\xfe', b'\xcf\xfa\xed\xfe', b'\xca\xfe\xba\xbe'
+    )),
+    (11, (b'FWS', b'CWS', b'ZWS')),
+    (12, (b'\xca\xfe\xba\xbe',))
+)
+magicTags = (
+    (3, (b'<html', b'<!doctype html', b'<script')),
+    (10, (b'%pdf-',))
+)
+textBytes = bytes(range(32, 127)) + b'\t\n\r\f\b'
+headSize = 65536
+timeoutMatch = (None, 'Heuristics.Limits.Exceeded.MaxScanTime')
+
+
+def detectTypes(head):
+    head = bytes(head[:1024])
+    lowered = head.lower()
+    types = {0}
+    for targetType, prefixes in magicPrefixes:
+        if head.startswith(prefixes):
+            types.add(targetType)
+    for targetType, tags in magicTags:
+        if any(tag in lowered for tag in tags):
+            types.add(targetType)
+    if head and not head.translate(None, textBytes):
+        types.add(7)
+    return types
+
+
+def peEntryPoint(head):
+    lfanew = struct.unpack_from('<I', head, 0x3c)[0]
+    if head[lfanew:lfanew+4] != b'PE\x00\x00':
+        return None
+    sections, optSize = struct.unpack_from('<H12xH', head, lfanew + 6)
+    optStart = lfanew + 24
+    entry = struct.unpack_from('<I', head, optStart + 16)[0]
+    for index in range(sections):
+        virtualSize, address, rawSize, rawStart = struct.unpack_from(
+            '<4I', head, optStart + optSize + index*40 + 8
+        )
+        if address <= entry < address + max(virtualSize, rawSize):
+            return rawStart + entry - address
+    return entry
 
-    def match(self, fileHash):
-        if self._signature == fileHash:
-            return True
-        return False
+
+def elfEntryPoint(head):
+    order = '<' if head[5] == 1 else '>'
+    if head[4] == 2:
+        entry, phStart = struct.unpack_from(order + 'QQ', head, 24)
+        phSize, phCount = struct.unpack_from(order + 'HH', head, 54)
+        layout = order + 'I4xQQ8xQ'
+    else:
+        entry, phStart = struct.unpack_from(order + 'II', head, 24)
+        phSize, phCount = struct.unpack_from(order + 'HH', head, 42)
+        layout = order + 'III4xI'
+    for index in range(phCount):
+        kind, fileStart, address, fileSize = struct.unpack_from(
+            layout, head, phStart + index*phSize
+        )
+        if kind == 1 and address <= entry < address + fileSize:
+            return fileStart + entry - address
+    return None
+
+
+def entryPoint(head):
+    try:
+        if head[:2] == b'MZ':
+            return peEntryPoint(head)
+        if head[:4] == b'\x7fELF':
+            return elfEntryPoint(head)
+    except (struct.error, IndexError):
+        pass
+    return None
+
+
+class BodyStream():
+    def __init__(self, sigBase, fileSize, stats=None, budget=None):
+        self._sigBase = sigBase
+        self._fileSize = fileSize
+        self._stats = stats
+        self._budget = budget or None
+        self._clock = 0.0
+        self.expired = False
+        self._sigTimes = {}
+        self._cursor = [0]
+        self._tail = b''
+        self._base = 0
+        self._pending = []
+        self._progress = {}
+        self._best = {}
+        self._found = {}
+        self._types = None
+        self._ranges = {}
+        self.head = b''
+
+    def inspect(self, head):
+        self.head = head
+        self._types = detectTypes(head)
+        entry = entryPoint(head)
+        signatures = self._sigBase.bodySignatures
+        for sigIndex in self._sigBase.anchoredSigs:
+            sig = signatures[sigIndex]
+            if sig.targetType not in self._types:
+                continue
+            startRange = sig.startRange(self._fileSize, entry)
+            if startRange is not None:
+                self._ranges[sigIndex] = startRange
+
+    def startClock(self):
+        self._clock = time.perf_counter()
+        return not self.expired
+
+    def stopClock(self):
+        if self._budget is not None:
+            self._budget -= time.perf_counter() - self._clock
+
+    def overBudget(self):
+        if self._budget is None:
+            return False
+        if time.perf_counter() - self._clock > self._budget:
+            self.expired = True
+        return self.expired
+
+    def feedRange(self, buffer, start, end):
+        if not self.startClock():
+            return
+        if self._types is None:
+            self.inspect(buffer[:headSize])
+        hits = self._sigBase.matcher.searchRange(
+            buffer, start, end, self._cursor
+        )
+        self.processHits(buffer, len(buffer), hits, True)
+        self.stopClock()
+
+    def feed(self, chunk):
+        if not self.startClock():
+            return
+        if self._types is None:
+            self.inspect(chunk[:headSize])
+        window = self._tail + chunk if self._tail else chunk
+        windowEnd = self._base + len(window)
+        chunkStart = windowEnd - len(chunk)
+        hits = self._sigBase.matcher.search(chunk, self._cursor)
+        hits = ((chunkStart + end, value) for end, value in hits)
+        self.processHits(window, windowEnd, self._pending, False)
+        if not self._pending:
+            self.processHits(window, windowEnd, hits, False)
+        self._pending.extend(hits)
+        keep = self._sigBase.overlap
+        if self._pending:
+            keep += windowEnd - self._pending[0][0]
+        keep = min(len(window), keep)
+        self._tail = bytes(window[len(window)-keep:])
+        self._base = windowEnd - keep
+        self.stopClock()
+
+    def processHits(self, window, windowEnd, hits, final):
+        signatures = self._sigBase.bodySignatures
+        timing = self._stats is not None
+        deferred = []
+        for end, (sigIndex, partIndex) in hits:
+            if deferred:
+                deferred.append((end, (sigIndex, partIndex)))
+                continue
+            if sigIndex in self._found:
+                continue
+            if self.overBudget():
+                return
+            if sigIndex in self._best and end >= self._best[sigIndex][1]:
+                nextPart = self._progress.get(sigIndex, (0,))[0]
+                self._progress[sigIndex] = (
+                    nextPart + 1, *self._best.pop(sigIndex)
+                )
+            nextPart, start, minNext = self._progress.get(sigIndex, (0, 0, 0))
+            if nextPart != partIndex:
+                continue
+            sig = signatures[sigIndex]
+            if sig.targetType not in self._types:
+                continue
+            part = sig.parts[partIndex]
+            low = max(end - part.before, minNext + part.minGap)
+            high = end + part.after
+            startLimit = None
+            if partIndex == 0 and sig.offset is not None:
+                if sigIndex not in self._ranges:
+                    continue
+                rangeStart, startLimit = self._ranges[sigIndex]
+                low = max(low, rangeStart + part.minGap)
+            if not final and high > windowEnd:
+                deferred.append((end, (sigIndex, partIndex)))
+                continue
+            low = max(low - self._base, 0)
+            high = min(high, windowEnd) - self._base
+            if timing:
+                began = time.perf_counter()
+            if startLimit is not None:
+                startLimit -= self._base
+            span = part.verify(
+                window, end - self._base, low, high, startLimit
+            )
+            if timing:
+                total = self._sigTimes.setdefault(sigIndex, [0.0, 0])
+                total[0] += time.perf_counter() - began
+                total[1] += 1
+            if span is None:
+                continue
+            if partIndex == 0:
+                start = span[0] + self._base
+            spanEnd = span[1] + self._base
+            if partIndex + 1 == len(sig.parts):
+                self._found[sigIndex] = (start, spanEnd)
+            else:
+                best = self._best.get(sigIndex)
+                if best is None or spanEnd < best[1]:
+                    self._best[sigIndex] = (start, spanEnd)
+        self._pending = deferred
+
+    def finish(self):
+        if self.startClock():
+            if self._types is None:
+                self.inspect(b'')
+            window = self._tail
+            windowEnd = self._base + len(window)
+            self.processHits(window, windowEnd, self._pending, True)
+        if self._stats is not None:
+            self._stats.addSigTimes(self._sigTimes)
+            if self.expired:
+                self._stats.count(matchTimeouts=1)
+        if not self._found:
+            return timeoutMatch if self.expired else None
+        sigIndex = min(self._found)
+        sig = self._sigBase.bodySignatures[sigIndex]
+        return self._found[sigIndex], sig.malwareName
+
+
+class MultiHash():
+    def __init__(self, algorithms):
+        self._hashes = {
+            algorithm: hashlib.new(algorithm) for algorithm in algorithms
+        }
+
+    def update(self, data):
+        for fileHash in self._hashes.values():
+            fileHash.update(data)
+
+    def hexdigests(self):
+        return {
+            algorithm: fileHash.hexdigest()
+            for algorithm, fileHash in self._hashes.items()
+        }
 
 
 class SigBase():
+    cacheVersion = 8
+    hashAlgorithms = {32: 'md5', 40: 'sha1', 64: 'sha256'}
+
     @staticmethod
     def getFields(line, fieldIndices):
         fields = line[:-1].split(':')
         return [fields[index] for index in fieldIndices]
 
-    def __init__(self, bodyPath, hashPath):
-        self._bodySignatures = []
-        self._hashSignatures = []
+    @staticmethod
+    def sourceKey(paths):
+        key = []
+        for path in paths:
+            sourceStat = os.stat(path)
+            key.append((
+                str(Path(path).resolve()),
+                sourceStat.st_size,
+                sourceStat.st_mtime_ns
+            ))
+        return key
+
+    @staticmethod
+    def hashPaths(hashPath):
+        paths = [hashPath]
+        extraPath = Path(hashPath).with_suffix('.hsb')
+        if extraPath != Path(hashPath) and extraPath.exists():
+            paths.append(extraPath)
+        return paths
+
+    def __init__(self, bodyPath, hashPath, useCache=True):
+        cachePath = Path(bodyPath).with_suffix('.cache')
+        hashPaths = self.hashPaths(hashPath)
+        sources = self.sourceKey([bodyPath, *hashPaths])
+        if useCache and self.loadCache(cachePath, sources):
+            self.fromCache = True
+            return
+        self.load(bodyPath, hashPaths)
+        if useCache:
+            self.saveCache(cachePath, sources)
+        self.fromCache = False
+
+    def loadCache(self, cachePath, sources):
+        try:
+            with open(cachePath, 'rb') as cacheFile:
+                version, cachedSources, state = pickle.load(cacheFile)
+        except (OSError, EOFError, pickle.PickleError, AttributeError):
+            return False
+        if version != self.cacheVersion or cachedSources != sources:
+            return False
+        self.__dict__.update(state)
+        return True
+
+    def saveCache(self, cachePath, sources):
+        tempPath = cachePath.with_name(f'{cachePath.name}.{os.getpid()}')
+        try:
+            with open(tempPath, 'wb') as cacheFile:
+                cache = (self.cacheVersion, sources, self.__dict__)
+                pickle.dump(cache, cacheFile, pickle.HIGHEST_PROTOCOL)
+            os.replace(tempPath, cachePath)
+        except OSError:
+            tempPath.unlink(missing_ok=True)
+
+    def load(self, bodyPath, hashPaths):
+        version = hashlib.md5(str(self.cacheVersion).encode())
+        for path in (bodyPath, *hashPaths):
+            with open(path, 'rb') as sigFile:
+                version.update(sigFile.read())
+        self.version = version.hexdigest()
+        self.bodySignatures = []
+        self._hashSizes = {}
+        self._hashIndex = {}
         with open(bodyPath) as sigFile:
             for line in sigFile:
-                self._bodySignatures.append(
-                    BodySignature(*self.getFields(line, [0, 3]))
-                )
-        with open(hashPath) as sigFile:
-            for line in sigFile:
-                self._hashSignatures.append(
-                    HashSignature(*self.getFields(line, [2, 0, 1]))
-                )
-        self.lenBase = len(self._bodySignatures)
-
-    def bodySigInFile(self, hexFile, callback):
-        count = 0
-        for sig in self._bodySignatures:
-            if callback is not None:
-                if callback((count*100)//self.lenBase):
-                    return False
-            match = sig.match(hexFile)
-            if match:
-                return match, sig.malwareName
-            count += 1
+                fields = self.getFields(line, [0, 1, 2, 3])
+                try:
+                    self.bodySignatures.append(BodySignature(*fields))
+                except ValueError as error:
+                    print(f'skipping {fields[0]}: {error}', file=sys.stderr)
+        for hashPath in hashPaths:
+            with open(hashPath) as sigFile:
+                for line in sigFile:
+                    self.addHash(*self.getFields(line, [0, 1, 2]))
+        self.lenBase = len(self.bodySignatures)
+        self.buildMatcher()
+
+    def buildMatcher(self):
+        self.matcher = ahoCorasick.Automaton()
+        self.overlap = 0
+        self.anchoredSigs = []
+        for sigIndex, sig in enumerate(self.bodySignatures):
+            if sig.offset is not None:
+                self.anchoredSigs.append(sigIndex)
+            for partIndex, part in enumerate(sig.parts):
+                for anchor in part.anchors:
+                    self.matcher.add(anchor, (sigIndex, partIndex))
+            self.overlap = max(self.overlap, sig.maxPartLen)
+        self.matcher.build()
+        self.minBodyLen = min(
+            (sig.minLen for sig in self.bodySignatures), default=None
+        )
+        self.targetTypes = {sig.targetType for sig in self.bodySignatures}
+
+    def openStream(self, fileSize, stats=None, budget=None):
+        return BodyStream(self, fileSize, stats, budget)
+
+    def bodySigInFile(self, fileBytes, abort):
+        if abort is not None and abort.is_set():
+            return False
+        stream = self.openStream(len(fileBytes))
+        stream.feed(fileBytes)
+        return stream.finish()
+
+    @staticmethod
+    def hashKey(fileHash, fileSize):
+        if fileSize is None:
+            return bytes.fromhex(fileHash)
+        return fileSize.to_bytes(8, 'little') + bytes.fromhex(fileHash)
+
+    def addHash(self, fileHash, fileSize, name):
+        algorithm = self.hashAlgorithms[len(fileHash)]
+        fileSize = None if fileSize == '*' else int(fileSize)
+        self._hashSizes.setdefault(algorithm, set()).add(fileSize)
+        self._hashIndex[self.hashKey(fileHash, fileSize)] = sys.intern(name)
+
+    def digestsFor(self, fileSize):
+        if fileSize is None:
+            return tuple(self._hashSizes)
+        return tuple(
+            algorithm for algorithm, sizes in self._hashSizes.items()
+            if fileSize in sizes or None in sizes
+        )
+
+    def needsHash(self, fileSize):
+        return bool(self.digestsFor(fileSize))
+
+    def skipReason(self, fileSize, readHead):
+        if self.needsHash(fileSize):
+            return None
+        if fileSize == 0:
+            return 'empty'
+        if self.minBodyLen is None or fileSize < self.minBodyLen:
+            return 'size'
+        if 0 in self.targetTypes or readHead is None:
+            return None
+        if self.targetTypes.isdisjoint(detectTypes(readHead())):
+            return 'type'
         return None
 
-    def fileHashMatch(self, fileHash, fileSize):
-        for sig in self._hashSignatures:
-            if sig.getSize() == fileSize:
-                if sig.match(fileHash):
-                    return sig.malwareName
+    def fileHashMatch(self, digests, fileSize):
+        if not digests:
+            return None
+        for algorithm, sizes in self._hashSizes.items():
+            if algorithm not in digests:
+                continue
+            for size in (fileSize, None):
+                if size not in sizes:
+                    continue
+                key = self.hashKey(digests[algorithm], size)
+                if (match := self._hashIndex.get(key)):
+                    return match
         return None
 
-    def scanFile(self, fileHash, fileSize, hexFile, callback):
-        if (match := self.fileHashMatch(fileHash, fileSize)):
+    def scanFile(self, digests, fileSize, bodyMatch):
+        fileHash = digests.get('md5') if digests else None
+        if (match := self.fileHashMatch(digests, fileSize)):
             match = match.replace('.', ' ')
             return (True, fileHash, match), False
-        elif (match := self.bodySigInFile(hexFile, callback)):
+        elif (match := bodyMatch):
             name = match[1].replace('.', ' ')
-            return (True, fileHash, name, match[0].span()), True
+            if match[0] is None:
+                return (True, fileHash, name), False
+            return (True, fileHash, name, match[0]), True
         else:
             if match is None:
                 return (False, fileHash), None
@@ -0,0 +1,107 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+libc = ctypes.CDLL(
+    ctypes.util.find_library('c') or 'libc.so.6', use_errno=True
+)
+
+
+class Watcher():
+    def __init__(self, root, debounce=1.0):
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.root = os.path.abspath(root)
+        self.debounce = debounce
+        self.failed = []
+        self.overflowed = False
+        self._dirs = {}
+        self._pending = {}
+        self._only = None
+        if os.path.isdir(self.root):
+            self.addTree(self.root, False)
+        else:
+            self._only = self.root
+            self.addWatch(os.path.dirname(self.root))
+
+    def addWatch(self, path):
+        wd = libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            self.failed.append(path)
+            return
+        self._dirs[wd] = path
+
+    def addTree(self, root, queueFiles):
+        now = time.monotonic()
+        for dirPath, dirNames, fileNames in os.walk(root):
+            self.addWatch(dirPath)
+            if queueFiles:
+                for name in fileNames:
+                    self.queue(os.path.join(dirPath, name), now)
+
+    def queue(self, path, now):
+        if self._only is not None and path != self._only:
+            return
+        first = self._pending.get(path, (now, now))[0]
+        self._pending[path] = (first, now)
+
+    def readEvents(self, timeout):
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return
+        data = os.read(self._fd, 65536)
+        now = time.monotonic()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset+length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            if wd not in self._dirs:
+                continue
+            path = os.path.join(self._dirs[wd], os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.addTree(path, True)
+            else:
+                self.queue(path, now)
+
+    def ready(self, timeout=0):
+        self.readEvents(timeout)
+        now = time.monotonic()
+        paths = []
+        for path, (first, last) in list(self._pending.items()):
+            quiet = now - last >= self.debounce
+            if quiet or now - first >= self.debounce * 10:
+                paths.append(path)
+                del self._pending[path]
+        return paths
+
+    def takeOverflow(self):
+        overflowed = self.overflowed
+        self.overflowed = False
+        return overflowed
+
+    def close(self):
+        os.close(self._fd)